@@ -0,0 +1,266 @@
+# ruff: noqa: F403, F405
+from definitions import *
+from config import parse, results_dir
+from catalog import Catalog
+import windprofiles.process as process
+import multiprocessing
+import pandas as pd
+import numpy as np
+import json
+import io
+import os
+
+archive_dir = os.path.join(results_dir, "archive")
+
+SLOT = pd.Timedelta(30, "min") # each raw file fills one slot of ROWS_PER_FILE rows on a regular 50 Hz grid
+
+# Layout of results/archive/{key}: one SOURCE_DTYPE .npy per formatted column ({var}_{b}.npy, converted units, no QC),
+# a bool {var}_{b}.qc.npy of the values QC removes, present.npy marking rows that came from a raw file, and meta.json
+# holding the grid origin and the raw file (path, mtime, size) compiled into each slot. Everything is memory-mapped.
+
+
+def signature() -> dict:
+    # Anything that changes the archived values or QC masks; an archive compiled with other settings is ignored
+    return json.loads(json.dumps({
+        "version" : ARCHIVE_VERSION,
+        "rows_per_file" : ROWS_PER_FILE,
+        "dtype" : SOURCE_DTYPE, # stored as parsed, so that archived files summarize exactly as raw ones do
+        "units" : SOURCE_UNITS,
+        "gravity" : LOCATION.g,
+        "header_map" : HEADER_MAP,
+        "drop_booms" : DROP_BOOMS,
+        "qc" : [OUTLIER_REMOVAL_WINDOW, OUTLIER_REMOVAL_SIGMA],
+    }))
+
+
+def file_entry(filepath: os.PathLike) -> list:
+    stat = os.stat(filepath)
+    return [os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size]
+
+
+def read_meta(directory: os.PathLike) -> dict | None:
+    try:
+        with open(os.path.join(directory, "meta.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_meta(directory: os.PathLike, meta: dict) -> None:
+    path = os.path.join(directory, "meta.json")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, path)
+
+
+def grow(path: os.PathLike, length: int) -> None:
+    # Lengthens a 1-D .npy file to `length` elements (the new ones zero, i.e. False) without disturbing existing memory
+    # maps of it: the header is rewritten in place when the new shape fits its padding, otherwise the file is replaced
+    with open(path, "r+b") as f:
+        version = np.lib.format.read_magic(f)
+        read_header, write_header = {(1, 0) : (np.lib.format.read_array_header_1_0, np.lib.format.write_array_header_1_0),
+                                     (2, 0) : (np.lib.format.read_array_header_2_0, np.lib.format.write_array_header_2_0)}[version]
+        _, _, dtype = read_header(f)
+        offset = f.tell()
+        header = io.BytesIO()
+        write_header(header, {"descr" : np.lib.format.dtype_to_descr(dtype), "fortran_order" : False, "shape" : (length,)})
+        if len(header.getvalue()) == offset:
+            f.seek(0)
+            f.write(header.getvalue())
+            f.truncate(offset + length * dtype.itemsize)
+            return
+    old = np.load(path, mmap_mode = "r")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    new = np.lib.format.open_memmap(tmp, mode = "w+", dtype = old.dtype, shape = (length,))
+    new[:len(old)] = old
+    new.flush()
+    del new
+    os.replace(tmp, path)
+
+
+class Archive:
+    # Read access to a compiled campaign. `values` gives slices of the memory-mapped columns, which are views unless
+    # masked (missing files, and QC'd values when qc is set); `frame` copies them into a DataFrame.
+    def __init__(self, key: str):
+        self.key = key
+        self.directory = os.path.join(archive_dir, key)
+        if (meta := read_meta(self.directory)) is None:
+            raise FileNotFoundError(f"No compiled archive for {key} in {archive_dir}")
+        self.fresh = meta["signature"] == signature()
+        self.origin = pd.Timestamp(meta["origin"], tz = "UTC")
+        self.rows = meta["slots"] * ROWS_PER_FILE
+        self.columns = meta["columns"]
+        self.files = {path : (slot, mtime, size) for slot, path, mtime, size in meta["files"]}
+        self.arrays = {}
+
+    def array(self, name: str) -> np.ndarray:
+        if name not in self.arrays:
+            self.arrays[name] = np.load(os.path.join(self.directory, f"{name}.npy"), mmap_mode = "r")
+        return self.arrays[name]
+
+    def row_of(self, time: pd.Timestamp) -> int:
+        return int(np.clip(round((pd.Timestamp(time).tz_convert("UTC") - self.origin) / pd.Timedelta(1, "s") * SAMPLING_FREQUENCY), 0, self.rows))
+
+    def time_index(self, lo: int, hi: int) -> pd.DatetimeIndex:
+        ns = self.origin.value + np.arange(lo, hi, dtype = np.int64) * (10**9 // SAMPLING_FREQUENCY)
+        return pd.to_datetime(ns, utc = True).tz_convert(LOCATION.timezone)
+
+    def values(self, lo: int, hi: int, qc: bool = True, columns: list[str] = None) -> dict[str, np.ndarray]:
+        present = self.array("present")[lo:hi]
+        data = {}
+        for col in (self.columns if columns is None else columns):
+            x = self.array(col)[lo:hi]
+            missing = ~present
+            if qc:
+                missing = missing | self.array(f"{col}.qc")[lo:hi]
+            data[col] = np.where(missing, np.nan, x) if missing.any() else x
+        return data
+
+    def frame(self, lo: int, hi: int, qc: bool = True, columns: list[str] = None, index = None) -> pd.DataFrame:
+        return pd.DataFrame(self.values(lo, hi, qc, columns), index = index)
+
+    def slice(self, start: pd.Timestamp, end: pd.Timestamp, qc: bool = True, columns: list[str] = None) -> pd.DataFrame:
+        # Rows in [start, end) that came from a raw file, indexed by local time
+        lo, hi = self.row_of(start), self.row_of(end)
+        df = self.frame(lo, hi, qc, columns, index = self.time_index(lo, hi))
+        present = self.array("present")[lo:hi]
+        return df if present.all() else df[present]
+
+    def holds(self, filepath: os.PathLike) -> bool:
+        # Whether the current version of a raw file is archived
+        path, mtime, size = file_entry(filepath)
+        return self.fresh and (entry := self.files.get(path)) is not None and entry[1:] == (mtime, size)
+
+    def file_frame(self, filepath: os.PathLike, qc: bool = True, columns: list[str] = None) -> pd.DataFrame | None:
+        # The archived copy of a raw file, as process_file would produce it; None if the file is not (or no longer) archived
+        if not self.holds(filepath):
+            return None
+        lo = self.files[os.path.abspath(filepath)][0] * ROWS_PER_FILE
+        n = int(self.array("present")[lo:lo + ROWS_PER_FILE].sum()) # a file's rows fill the start of its slot
+        return self.frame(lo, lo + n, qc, columns)
+
+    def eliminations(self, filepath: os.PathLike) -> dict[str, int]:
+        # Values of each column that QC removed from an archived raw file, as qc_frame counts them
+        lo = self.files[os.path.abspath(filepath)][0] * ROWS_PER_FILE
+        present = self.array("present")[lo:lo + ROWS_PER_FILE]
+        return {col : int((self.array(f"{col}.qc")[lo:lo + ROWS_PER_FILE] & present).sum()) for col in self.columns}
+
+
+_opened = {} # key -> (meta mtime, Archive)
+
+
+def find(filepath: os.PathLike) -> Archive | None:
+    # Up-to-date compiled archive holding a raw file, if any
+    if not os.path.isdir(archive_dir):
+        return None
+    path = os.path.abspath(filepath)
+    for key in os.listdir(archive_dir):
+        try:
+            mtime = os.stat(os.path.join(archive_dir, key, "meta.json")).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        if key not in _opened or _opened[key][0] != mtime:
+            _opened[key] = (mtime, Archive(key))
+        if (archive := _opened[key][1]).fresh and path in archive.files:
+            return archive
+    return None
+
+
+def compile_file(filepath: os.PathLike) -> tuple[str, list[str], np.ndarray, np.ndarray] | tuple[str, None, None, None]:
+    # Converted values and QC removal mask (rows x columns) of one raw file
+    from process import load_and_format_file, qc_frame # process imports this module
+    try:
+        df, _ = load_and_format_file(filepath)
+        df = process.convert_dataframe_units(df, from_units = SOURCE_UNITS, gravity = LOCATION.g)
+        qcd, _ = qc_frame(df)
+    except Exception as e:
+        print(f"Failed to compile {filepath}: {e}")
+        return filepath, None, None, None
+    return filepath, list(df.columns), df.to_numpy(dtype = SOURCE_DTYPE), (df.notna() & qcd.isna()).to_numpy()
+
+
+def compile_campaign(key: str, root: os.PathLike, nproc: int = NPROC) -> None:
+    from process import source_columns # process imports this module
+    catalog = Catalog(key, root)
+    if not len(catalog):
+        print(f"No raw files found for {key} in {root}")
+        return
+    directory = os.path.join(archive_dir, key)
+    os.makedirs(directory, exist_ok = True)
+
+    origin = catalog.times[0]
+    slots = (catalog.times[-1] - origin) // SLOT.value + 1
+    columns = list(source_columns().values())
+    old = read_meta(directory)
+    # a campaign that only gained slots at the end (new files) keeps its compiled slots; anything else is recompiled
+    reuse = old is not None and old["signature"] == signature() and old["origin"] == origin and old["slots"] <= slots and old["columns"] == columns
+    done = {path : [slot, path, mtime, size] for slot, path, mtime, size in old["files"]} if reuse else {}
+
+    current = {os.path.abspath(filepath) for filepath in catalog.paths}
+    removed_slots = [done.pop(path)[0] for path in list(done) if path not in current]
+
+    todo = {}
+    for ns, filepath in zip(catalog.times, catalog.paths):
+        slot, off_grid = divmod(ns - origin, SLOT.value)
+        if off_grid:
+            print(f"Skipping {filepath}, which does not start on the half-hour grid")
+            continue
+        entry = file_entry(filepath)
+        if done.get(entry[0], [None])[1:] != entry:
+            todo[filepath] = slot
+            done.pop(entry[0], None)
+
+    names = dict([(col, np.dtype(SOURCE_DTYPE)) for col in columns] + [(f"{col}.qc", np.bool_) for col in columns] + [("present", np.bool_)])
+    paths = {name : os.path.join(directory, f"{name}.npy") for name in names}
+    if reuse and old["slots"] < slots:
+        for path in paths.values():
+            grow(path, slots * ROWS_PER_FILE)
+    meta = {"signature" : signature(), "origin" : origin, "slots" : slots, "columns" : columns, "files" : list(done.values())}
+    write_meta(directory, meta) # slots being rewritten are not trusted until the end
+    if reuse:
+        arrays = {name : np.lib.format.open_memmap(paths[name], mode = "r+") for name in names}
+    else: # compiled next to the old arrays and swapped in at the end, so that readers' maps of them are never truncated
+        arrays = {name : np.lib.format.open_memmap(f"{paths[name]}.{os.getpid()}.tmp", mode = "w+", dtype = dtype, shape = (slots * ROWS_PER_FILE,))
+                  for name, dtype in names.items()}
+    for slot in removed_slots: # raw file no longer there
+        arrays["present"][slot * ROWS_PER_FILE:(slot + 1) * ROWS_PER_FILE] = False
+    print(f"Compiling {len(todo)} of {len(catalog)} files of {key} into {directory}")
+
+    with multiprocessing.Pool(max(1, nproc)) as pool:
+        for i, (filepath, file_columns, values, removed) in enumerate(pool.imap_unordered(compile_file, todo), 1):
+            lo = todo[filepath] * ROWS_PER_FILE
+            n = 0 if values is None else min(len(values), ROWS_PER_FILE)
+            for col in columns:
+                if file_columns is not None and col in file_columns:
+                    j = file_columns.index(col)
+                    arrays[col][lo:lo + n] = values[:n, j]
+                    arrays[f"{col}.qc"][lo:lo + n] = removed[:n, j]
+                else:
+                    arrays[col][lo:lo + ROWS_PER_FILE] = np.nan
+            arrays["present"][lo:lo + n] = True
+            arrays["present"][lo + n:lo + ROWS_PER_FILE] = False
+            if values is not None:
+                meta["files"].append([todo[filepath]] + file_entry(filepath))
+            if i % 48 == 0 or i == len(todo):
+                print(f"Compiled {i} of {len(todo)} files")
+
+    for name, array in arrays.items():
+        array.flush()
+        if not reuse:
+            os.replace(array.filename, paths[name])
+    meta["files"].sort()
+    write_meta(directory, meta)
+
+
+def main():
+    args = parse("compile")
+    dirs = args["process"]
+    selection = args["selection"]
+    if selection not in dirs:
+        raise KeyError(f"{selection} not in process keys")
+    compile_campaign(selection, os.path.join(args["data"], dirs[selection]), args.get("nproc") or NPROC)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# ruff: noqa: F403, F405
+from definitions import *
+import pandas as pd
+import numpy as np
+
+SCALE_VARIABLES = ["u", "v", "w", "vpt"]
+
+
+def autocorrelations(x: np.ndarray, max_lag: int = None) -> np.ndarray:
+    # NaN-aware autocorrelation of each column of a (rows x series) array for lags 0..max_lag, from zero-padded FFTs.
+    # Each lag's autocovariance is normalized by the number of valid pairs at that lag, then by the lag-0 value.
+    n = x.shape[0]
+    max_lag = n - 1 if max_lag is None else min(max_lag, n - 1)
+    valid = np.isfinite(x)
+    counts = valid.sum(axis = 0)
+    mean = np.where(valid, x, 0.).sum(axis = 0) / np.maximum(counts, 1)
+    x0 = np.where(valid, x - mean, 0.)
+
+    nfft = 1 << int(np.ceil(np.log2(2 * n - 1))) # padding to >= 2n - 1 makes the circular correlation linear
+    spectrum = np.fft.rfft(x0, nfft, axis = 0)
+    mask_spectrum = np.fft.rfft(valid.astype(np.float64), nfft, axis = 0)
+    acov = np.fft.irfft(np.abs(spectrum) ** 2, nfft, axis = 0)[:max_lag + 1]
+    pairs = np.rint(np.fft.irfft(np.abs(mask_spectrum) ** 2, nfft, axis = 0)[:max_lag + 1])
+
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        acov = np.where(pairs > 0, acov / pairs, np.nan)
+        return acov / acov[0]
+
+
+def integral_time_scales(acf: np.ndarray, dt: float) -> np.ndarray:
+    # Integral of each autocorrelation column from lag 0 up to its first zero crossing (or the last lag if it never crosses)
+    below = ~(acf > 0) # NaN counts as a crossing
+    below[0] = False
+    first = np.where(below.any(axis = 0), below.argmax(axis = 0), acf.shape[0])
+    lags = np.arange(acf.shape[0])[:, None]
+    inside = np.where(lags < first, np.nan_to_num(acf), 0.)
+    scales = (inside.sum(axis = 0) - 0.5 * inside[0]) * dt # trapezoid rule, with the open end truncated at the crossing
+    return np.where(np.isfinite(acf[0]), scales, np.nan)
+
+
+def integral_scales(df: pd.DataFrame, booms: list[int], fs: float = SAMPLING_FREQUENCY) -> dict:
+    # Integral time scales ({var}_{b}_its, s) and, via Taylor's hypothesis with the streamwise mean wind,
+    # integral length scales ({var}_{b}_ils, m) for each boom of a streamwise-aligned chunk
+    names = [f"{var}_{b}" for b in booms for var in SCALE_VARIABLES]
+    x = df[names].to_numpy(dtype = np.float64)
+    acf = autocorrelations(x, max_lag = x.shape[0] // 2)
+    its = integral_time_scales(acf, 1 / fs).reshape(len(booms), len(SCALE_VARIABLES))
+
+    result = {}
+    for i, b in enumerate(booms):
+        speed = np.abs(np.nanmean(df[f"u_{b}"].to_numpy(dtype = np.float64)))
+        for j, var in enumerate(SCALE_VARIABLES):
+            result[f"{var}_{b}_its"] = its[i, j]
+            result[f"{var}_{b}_ils"] = its[i, j] * speed
+    return result
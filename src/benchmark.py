@@ -0,0 +1,210 @@
+# ruff: noqa: F403, F405
+from definitions import *
+from config import parse, results_dir
+import windprofiles.process as process
+from process import load_and_format_file, qc_step, summarize_df, summarize_file
+from catalog import get_datetime_from_filename
+import multiprocessing
+import tracemalloc
+import pandas as pd
+import numpy as np
+import platform
+import json
+import time
+import sys
+import os
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+bench_dir = os.path.join(results_dir, "benchmarks")
+data_dir = os.path.join(bench_dir, "data")
+baseline_path = os.path.join(bench_dir, "baseline.json")
+
+REGRESSION_TOLERANCE = 0.15 # fractional slowdown relative to the baseline that is reported as a regression
+
+# Typical values and turbulent spread in source units, used to synthesize raw files
+SYNTHETIC = {
+    "TSU" : (10., 3.),
+    "TSV" : (0., 3.),
+    "TSW" : (0., 1.),
+    "TST" : (50., 0.5),
+    "TT" : (50., 0.2),
+    "TRH" : (40., 1.),
+    "TBP" : (26.4, 0.005),
+    "TSN-TRANS" : (8., 3.),
+    "TSW-TRANS" : (-6., 3.),
+    "TSV-TRANS" : (0., 1.),
+    "TS-WS" : (10., 3.),
+    "TS-WD" : (225., 15.),
+}
+
+
+def peak_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10 # bytes on macOS, KiB elsewhere
+
+
+def synthetic_file(filepath: os.PathLike, seed: int) -> None:
+    # 50 Hz raw file in the tower's 120-column layout, with red-noise turbulence, spikes and dropouts
+    rng = np.random.default_rng(seed)
+    n = ROWS_PER_FILE
+    data = np.empty((n, len(SOURCE_HEADERS)), dtype = np.float64)
+    for i, head in enumerate(SOURCE_HEADERS):
+        source_type, boom = head.split("_")
+        mean, spread = SYNTHETIC[source_type]
+        if source_type in ["TSU", "TSN-TRANS", "TS-WS"]:
+            mean *= (ALL_HEIGHTS_DICT[int(boom)] / 10.) ** 0.2 # power-law shear
+        x = np.convolve(rng.normal(0, 1, n + 49), np.ones(50) / np.sqrt(50), mode = "valid") # ~1 s correlated noise
+        data[:, i] = mean + spread * x
+    spikes = rng.random(data.shape) < 2e-4
+    data[spikes] += rng.choice([-1, 1], spikes.sum()) * 20 * np.abs(data[spikes] + 1)
+    data[rng.random(data.shape) < 1e-4] = np.nan # isolated missing values
+    for _ in range(rng.integers(0, 3)): # occasional multi-second dropouts of a whole boom
+        boom = rng.choice(ALL_BOOMS)
+        start = rng.integers(0, n - 2500)
+        cols = [i for i, head in enumerate(SOURCE_HEADERS) if head.endswith(f"_{boom}")]
+        data[start:start + rng.integers(50, 2500), cols] = np.nan
+    pd.DataFrame(data).to_csv(filepath, header = False, index = False, float_format = "%.3f", compression = "gzip")
+
+
+def generate(count: int, regenerate: bool = False) -> list[str]:
+    os.makedirs(data_dir, exist_ok = True)
+    start = pd.Timestamp("2018-12-01 00:00", tz = "UTC")
+    files = []
+    for i in range(count):
+        time = start + i * pd.Timedelta(30, "min")
+        filepath = os.path.join(data_dir, f"FT_200m_tower_synthetic_D{time:%Y%m%d}_T{time:%H%M}.csv.gz")
+        assert get_datetime_from_filename(filepath) == time
+        if regenerate or not os.path.exists(filepath):
+            synthetic_file(filepath, seed = i)
+        files.append(filepath)
+    return files
+
+
+def measure(fn, *args, **kwargs):
+    # Returns fn's output along with its wall time, CPU time and peak traced allocation
+    tracemalloc.start()
+    t0, c0 = time.perf_counter(), time.process_time()
+    out = fn(*args, **kwargs)
+    wall, cpu = time.perf_counter() - t0, time.process_time() - c0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, {"wall" : wall, "cpu" : cpu, "peak_alloc_mb" : peak / 2**20}
+
+
+def bench_stages(files: list[str]) -> dict:
+    stages = {}
+    def record(name, stats, rows):
+        entry = stages.setdefault(name, {"wall" : 0., "cpu" : 0., "peak_alloc_mb" : 0., "rows" : 0})
+        entry["wall"] += stats["wall"]
+        entry["cpu"] += stats["cpu"]
+        entry["peak_alloc_mb"] = max(entry["peak_alloc_mb"], stats["peak_alloc_mb"])
+        entry["rows"] += rows
+
+    summaries = []
+    for filepath in files:
+        (df, booms), stats = measure(load_and_format_file, filepath)
+        record("load_and_format_file", stats, len(df))
+        df, stats = measure(process.convert_dataframe_units, df, from_units = SOURCE_UNITS, gravity = LOCATION.g)
+        record("convert_dataframe_units", stats, len(df))
+        df, stats = measure(qc_step, df, filepath)
+        record("qc_step", stats, len(df))
+        timestamp = get_datetime_from_filename(filepath).tz_convert(LOCATION.timezone)
+        for i in range(SPLIT_INTO_CHUNKS):
+            chunk = df.iloc[CHUNK_SIZE*i:CHUNK_SIZE*(i+1)]
+            row, stats = measure(summarize_df, chunk, booms, timestamp + i * pd.Timedelta(CHUNK_TIME, "min"))
+            record("summarize_df", stats, len(chunk))
+            summaries.append(row)
+
+    def write(rows):
+        res = pd.DataFrame([{k : v for k, v in row.items() if k not in SIDE_OUTPUTS} for row in rows]).set_index("time").sort_index()
+        res.to_csv(os.path.join(bench_dir, "summary.csv"), float_format = "%g")
+    _, stats = measure(write, summaries)
+    record("concat_and_write", stats, len(summaries))
+
+    for entry in stages.values():
+        entry["files_per_s"] = len(files) / entry["wall"]
+        entry["rows_per_s"] = entry["rows"] / entry["wall"]
+    return stages
+
+
+def bench_task(filepath: os.PathLike) -> float | None:
+    summarize_file(filepath, use_cache = False)
+    return peak_rss_mb()
+
+
+def bench_workers(files: list[str], worker_counts: list[int]) -> dict:
+    results = {}
+    for n in worker_counts:
+        t0 = time.perf_counter()
+        with multiprocessing.Pool(n) as pool:
+            rss = pool.map(bench_task, files, chunksize = 1)
+        wall = time.perf_counter() - t0
+        results[str(n)] = {
+            "wall" : wall,
+            "files_per_s" : len(files) / wall,
+            "rows_per_s" : len(files) * ROWS_PER_FILE / wall,
+            "peak_rss_mb_per_worker" : None if None in rss else max(rss),
+        }
+    return results
+
+
+def compare(current: dict, baseline: dict) -> list[str]:
+    regressions = []
+    for section in ["stages", "workers"]:
+        for name, entry in current[section].items():
+            if (base := baseline.get(section, {}).get(name)) is None:
+                continue
+            if entry["wall"] > base["wall"] * (1 + REGRESSION_TOLERANCE):
+                regressions.append(f"{section}/{name}: {entry['wall']:.3f} s vs baseline {base['wall']:.3f} s ({entry['wall'] / base['wall'] - 1:+.0%})")
+    return regressions
+
+
+def report(current: dict) -> None:
+    print(f"{'stage':>24} {'wall (s)':>9} {'cpu (s)':>9} {'files/s':>8} {'rows/s':>11} {'peak alloc (MB)':>16}")
+    for name, entry in current["stages"].items():
+        print(f"{name:>24} {entry['wall']:9.3f} {entry['cpu']:9.3f} {entry['files_per_s']:8.2f} {entry['rows_per_s']:11.0f} {entry['peak_alloc_mb']:16.1f}")
+    print(f"{'workers':>24} {'wall (s)':>9} {'files/s':>9} {'rows/s':>11} {'peak RSS/worker (MB)':>21}")
+    for n, entry in current["workers"].items():
+        rss = "n/a" if entry["peak_rss_mb_per_worker"] is None else f"{entry['peak_rss_mb_per_worker']:.1f}"
+        print(f"{n:>24} {entry['wall']:9.3f} {entry['files_per_s']:9.2f} {entry['rows_per_s']:11.0f} {rss:>21}")
+
+
+def main():
+    args = parse("benchmark")
+    files = generate(args["files"], args["regenerate"])
+
+    worker_counts = args.get("workers") or [n for n in [1, 2, 4, 8, 16, 32, 64] if n <= NPROC]
+
+    current = {
+        "machine" : {"platform" : platform.platform(), "processor" : platform.processor(), "cpus" : os.cpu_count()},
+        "files" : len(files),
+        "stages" : bench_stages(files),
+        "workers" : bench_workers(files, worker_counts),
+    }
+    report(current)
+
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if baseline.get("files") != current["files"]:
+            print(f"Baseline was recorded with {baseline.get('files')} files; skipping comparison")
+        elif regressions := compare(current, baseline):
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+        else:
+            print("No regressions against baseline.")
+
+    if args["save"] or not os.path.exists(baseline_path):
+        with open(baseline_path, "w") as f:
+            json.dump(current, f, indent = 2)
+        print(f"Saved baseline to {baseline_path}")
+
+
+if __name__ == "__main__":
+    main()
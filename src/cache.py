@@ -0,0 +1,108 @@
+# ruff: noqa: F403, F405
+from definitions import *
+from config import results_dir
+from outliers import QC_COLUMN_TYPES
+import pyarrow.parquet as pq
+import pyarrow as pa
+import pandas as pd
+import hashlib
+import json
+import os
+
+cache_dir = os.path.join(results_dir, "cache")
+
+
+def cache_key(filepath: os.PathLike, qc: bool) -> str:
+    # Anything that changes the converted/QC'd frame for a given raw file must be part of the key
+    stat = os.stat(filepath)
+    key = {
+        "version" : CACHE_VERSION,
+        "path" : os.path.abspath(filepath),
+        "mtime" : stat.st_mtime_ns,
+        "size" : stat.st_size,
+        "dtype" : SOURCE_DTYPE,
+        "headers" : SOURCE_HEADERS,
+        "units" : SOURCE_UNITS,
+        "gravity" : LOCATION.g,
+        "header_map" : HEADER_MAP,
+        "drop_booms" : DROP_BOOMS,
+        "qc" : [OUTLIER_REMOVAL_WINDOW, OUTLIER_REMOVAL_SIGMA, QC_COLUMN_TYPES] if qc else None,
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def cache_path(filepath: os.PathLike, qc: bool) -> str:
+    return os.path.join(cache_dir, f"{cache_key(filepath, qc)}.parquet")
+
+
+def load(filepath: os.PathLike, qc: bool, columns: list[str] = None) -> pd.DataFrame | None:
+    path = cache_path(filepath, qc)
+    try:
+        df = pd.read_parquet(path, columns = columns)
+    except (FileNotFoundError, OSError):
+        return None
+    try:
+        os.utime(path) # mark as recently used for LRU eviction
+    except OSError:
+        pass
+    return df
+
+
+def eliminations(filepath: os.PathLike, qc: bool) -> dict[str, int] | None:
+    # QC elimination counts stored with a cached frame, so that its warnings can be repeated on a cache hit
+    try:
+        metadata = pq.read_schema(cache_path(filepath, qc)).metadata or {}
+    except (FileNotFoundError, OSError):
+        return None
+    return json.loads(metadata[b"eliminations"]) if b"eliminations" in metadata else None
+
+
+def iter_chunks(filepath: os.PathLike, qc: bool):
+    # Cached frames are written with CHUNK_SIZE row groups, so they can be streamed one chunk at a time
+    path = cache_path(filepath, qc)
+    try:
+        parquet = pq.ParquetFile(path)
+    except (FileNotFoundError, OSError):
+        return None
+    os.utime(path)
+    return (batch.to_pandas() for batch in parquet.iter_batches(batch_size = CHUNK_SIZE))
+
+
+def store(df: pd.DataFrame, filepath: os.PathLike, qc: bool, elims: dict[str, int] = None) -> None:
+    path = cache_path(filepath, qc)
+    tmp = f"{path}.{os.getpid()}.tmp" # workers may race on the same file; write then atomically replace
+    table = pa.Table.from_pandas(df, preserve_index = False)
+    if elims is not None:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"eliminations" : json.dumps(elims).encode()})
+    pq.write_table(table, tmp, row_group_size = CHUNK_SIZE)
+    os.replace(tmp, path)
+    evict(CACHE_SIZE_LIMIT)
+
+
+def evict(limit: int) -> None:
+    # Least-recently-used eviction until the cache fits in `limit` bytes
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".parquet"):
+            continue
+        try:
+            stat = os.stat(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    entries.sort()
+    for _, size, name in entries:
+        if total <= limit:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def clear() -> None:
+    for name in os.listdir(cache_dir):
+        if name.endswith(".parquet") or name.endswith(".tmp"):
+            os.remove(os.path.join(cache_dir, name))
@@ -0,0 +1,101 @@
+from config import results_dir
+import pandas as pd
+import bisect
+import json
+import os
+
+catalog_dir = os.path.join(results_dir, "catalog")
+
+
+def get_datetime_from_filename(filepath: os.PathLike) -> pd.Timestamp:
+    filename = os.path.basename(filepath).split(".")[0]
+    DATE_STR = filename.split("_")[4]
+    YEAR = int(DATE_STR[1:5])
+    MONTH = int(DATE_STR[5:7])
+    DAY = int(DATE_STR[7:9])
+    TIME_STR = filename.split("_")[5]
+    HOUR = int(TIME_STR[1:3])
+    MIN = int(TIME_STR[3:5])
+    START_TIME = pd.Timestamp(year = YEAR, month = MONTH, day = DAY, hour = HOUR, minute = MIN, tz = "UTC")
+    return START_TIME
+
+
+class Catalog:
+    # Sorted start time -> raw file index over the day directories of one [process] data root.
+    # Persisted in results/catalog; a day directory is only rescanned when its mtime changes.
+    def __init__(self, key: str, root: os.PathLike):
+        self.key = key
+        self.root = root
+        self.path = os.path.join(catalog_dir, f"{key}.json")
+        self.days = {}
+        self.times = [] # UTC start times in ns, sorted
+        self.paths = []
+        self.refresh()
+
+    def refresh(self) -> bool:
+        # Returns whether anything changed since the last scan
+        saved = {}
+        if not self.days and os.path.exists(self.path):
+            with open(self.path) as f:
+                stored = json.load(f)
+            if stored.get("root") == os.path.abspath(self.root):
+                saved = stored["days"]
+        else:
+            saved = self.days
+
+        days = {}
+        changed = False
+        for day in sorted(os.listdir(self.root)):
+            daypath = os.path.join(self.root, day)
+            if not os.path.isdir(daypath):
+                continue
+            mtime = os.stat(daypath).st_mtime_ns
+            if (entry := saved.get(day)) is not None and entry["mtime"] == mtime:
+                days[day] = entry
+                continue
+            files = []
+            for name in os.listdir(daypath):
+                try:
+                    files.append([name, get_datetime_from_filename(name).value])
+                except (IndexError, ValueError):
+                    continue # not a raw data file
+            days[day] = {"mtime" : mtime, "files" : files}
+            changed = True
+        changed |= set(days) != set(saved)
+
+        if changed or not self.times:
+            index = sorted((ns, os.path.join(self.root, day, name)) for day, entry in days.items() for name, ns in entry["files"])
+            self.times = [ns for ns, _ in index]
+            self.paths = [path for _, path in index]
+        self.days = days
+        if changed:
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump({"root" : os.path.abspath(self.root), "days" : days}, f)
+            os.replace(tmp, self.path)
+        return changed
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def lookup(self, time: pd.Timestamp) -> str | None:
+        # Raw file starting exactly at `time`
+        ns = pd.Timestamp(time).tz_convert("UTC").value
+        i = bisect.bisect_left(self.times, ns)
+        if i < len(self.times) and self.times[i] == ns:
+            return self.paths[i]
+        return None
+
+    def containing(self, time: pd.Timestamp, duration: pd.Timedelta = pd.Timedelta(30, "min")) -> tuple[str, pd.Timestamp] | tuple[None, None]:
+        # Raw file whose period [start, start + duration) contains `time`, along with its start time
+        ns = pd.Timestamp(time).tz_convert("UTC").value
+        i = bisect.bisect_right(self.times, ns) - 1
+        if i >= 0 and ns < self.times[i] + duration.value:
+            return self.paths[i], pd.Timestamp(self.times[i], tz = "UTC")
+        return None, None
+
+    def between(self, start: pd.Timestamp = None, end: pd.Timestamp = None) -> list[str]:
+        # Raw files starting in [start, end)
+        lo = 0 if start is None else bisect.bisect_left(self.times, pd.Timestamp(start).tz_convert("UTC").value)
+        hi = len(self.times) if end is None else bisect.bisect_left(self.times, pd.Timestamp(end).tz_convert("UTC").value)
+        return self.paths[lo:hi]
@@ -1,10 +1,11 @@
 from windprofiles import Parser
+from definitions import LOCATION
 import pathlib
 import os
 
 parent_dir = pathlib.Path(__file__).parent.parent
 results_dir = os.path.join(parent_dir, "results")
-for r in ["analysis", "figures", "processed", "testing"]:
+for r in ["analysis", "archive", "benchmarks", "cache", "catalog", "figures", "processed", "testing"]:
     s = os.path.join(results_dir, r)
     os.makedirs(s, exist_ok = True)
 
@@ -17,8 +18,29 @@ def parse(mode: str):
             parser.add_argument("--nproc", "-n", type=int, metavar="N", help="Number of processors to use in multiprocessing (note - one will be used for log listening)")
             parser.add_argument("--only", "-o", type=str, metavar="NAME", help="Single directory to process, by key name in [process] config section")
             parser.add_argument("--test", "-t", action="store_true", help="Short run for testing purposes")
+            parser.add_argument("--resume", "-r", action="store_true", help="Skip raw files already summarized (per the results ledger) with the current code and config")
+            parser.add_argument("--start", type=str, metavar="TIME", help=f"Only process files starting at or after this time (local time, {LOCATION.timezone}, unless an offset is given)")
+            parser.add_argument("--end", type=str, metavar="TIME", help="Only process files starting before this time")
+            parser.add_argument("--profile", "-p", action="store_true", help="Run cProfile in every worker and merge the results into process_profile.prof")
+            parser.add_argument("--csv", action="store_true", help="Also export each campaign's summary as a CSV alongside the Parquet results store")
+            parser.add_argument("--retry-quarantined", action="store_true", help="Also attempt raw files that failed in earlier runs (listed in quarantine.json)")
+            parser.add_argument("--follow", "-f", action="store_true", help="After processing, keep watching the data directories and append new files to the results store as they are completed (implies --resume)")
             return parser.parse()
         case "interact":
             parser.add_argument("selection", type=str, help="Key of directory to inspect interactively")
             parser.add_argument("--test", "-t", action="store_true", help="Use testing output data")
             return parser.parse()
+        case "compile":
+            parser.add_argument("selection", type=str, help="Key of directory to compile into a memory-mapped archive")
+            parser.add_argument("--nproc", "-n", type=int, metavar="N", help="Number of processes to decode raw files with")
+            return parser.parse()
+        case "postprocess":
+            parser.add_argument("selection", type=str, help="Key of directory whose stored summaries to post-process")
+            parser.add_argument("--test", "-t", action="store_true", help="Use testing output data")
+            return parser.parse()
+        case "benchmark":
+            parser.add_argument("--files", "-f", type=int, default=4, metavar="N", help="Number of synthetic raw files to generate and process")
+            parser.add_argument("--workers", "-w", type=int, nargs="+", metavar="N", help="Worker counts to time the full pipeline with (default: 1, 2, 4, ... up to NPROC)")
+            parser.add_argument("--save", "-s", action="store_true", help="Save this run as the new baseline")
+            parser.add_argument("--regenerate", action="store_true", help="Regenerate the synthetic files even if they already exist")
+            return parser.parse()
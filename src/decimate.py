@@ -0,0 +1,82 @@
+import numpy as np
+
+
+def first_where(mask: np.ndarray, group: np.ndarray) -> np.ndarray:
+    # Index of the first True of `mask` within each group that has one
+    hits = np.flatnonzero(mask)
+    _, first = np.unique(group[hits], return_index = True)
+    return hits[first]
+
+
+def m4_indices(x: np.ndarray, y: np.ndarray, x0: float, x1: float, pixels: int) -> np.ndarray:
+    # Indices of the points of a series (x sorted) needed to draw [x0, x1] exactly at `pixels` columns: the first, last,
+    # minimum and maximum point (and first gap) in each column, plus one point beyond each edge so lines leave the axes.
+    lo = max(int(np.searchsorted(x, x0, "left")) - 1, 0)
+    hi = min(int(np.searchsorted(x, x1, "right")) + 1, len(x))
+    if hi - lo <= 4 * pixels or not x1 > x0:
+        return np.arange(lo, hi)
+    xs, ys = x[lo:hi], y[lo:hi]
+    column = np.clip(np.floor((xs - x0) / (x1 - x0) * pixels), -1, pixels).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, column[1:] != column[:-1]])
+    ends = np.r_[starts[1:], len(xs)] - 1
+    group = np.repeat(np.arange(len(starts)), ends - starts + 1)
+    nan = np.isnan(ys)
+    lows = np.minimum.reduceat(np.where(nan, np.inf, ys), starts)
+    highs = np.maximum.reduceat(np.where(nan, -np.inf, ys), starts)
+    picks = [starts, ends, first_where(ys == lows[group], group), first_where(ys == highs[group], group), first_where(nan, group)]
+    return lo + np.unique(np.concatenate(picks))
+
+
+class Decimated:
+    # Holds a series at full resolution while its artist only gets the M4 reduction for the current view,
+    # recomputed whenever the x limits or the axes size change. `indices` maps artist points back to the series.
+    def __init__(self, ax, x, y):
+        self.ax = ax
+        self.x = x
+        self.y = np.asarray(y, dtype = np.float64)
+        self.indices = m4_indices(np.arange(len(self.y), dtype = np.float64), self.y, 0, len(self.y) - 1, self.pixels())
+        self.artist = self.draw(self.indices)
+        self.xnum = np.asarray(ax.convert_xunits(x), dtype = np.float64) # x in axis units, for comparison with limits
+        ax.callbacks.connect("xlim_changed", lambda ax : self.redecimate())
+        ax.figure.canvas.mpl_connect("resize_event", lambda event : self.redecimate())
+
+    def pixels(self) -> int:
+        return max(int(self.ax.get_window_extent().width), 1)
+
+    def draw(self, indices: np.ndarray):
+        raise NotImplementedError
+
+    def update(self, indices: np.ndarray) -> None:
+        raise NotImplementedError
+
+    def redecimate(self) -> None:
+        x0, x1 = self.ax.get_xlim()
+        indices = m4_indices(self.xnum, self.y, x0, x1, self.pixels())
+        if not np.array_equal(indices, self.indices):
+            self.indices = indices
+            self.update(indices)
+            self.ax.figure.canvas.draw_idle()
+
+
+class DecimatedLine(Decimated):
+    def __init__(self, ax, x, y, **kwargs):
+        self.kwargs = kwargs
+        super().__init__(ax, x, y)
+
+    def draw(self, indices):
+        return self.ax.plot(self.x[indices], self.y[indices], **self.kwargs)[0]
+
+    def update(self, indices):
+        self.artist.set_data(self.xnum[indices], self.y[indices])
+
+
+class DecimatedScatter(Decimated):
+    def __init__(self, ax, x, y, **kwargs):
+        self.kwargs = kwargs
+        super().__init__(ax, x, y)
+
+    def draw(self, indices):
+        return self.ax.scatter(self.x[indices], self.y[indices], **self.kwargs)
+
+    def update(self, indices):
+        self.artist.set_offsets(np.column_stack([self.xnum[indices], self.y[indices]]))
@@ -1,7 +1,9 @@
 from windprofiles import Location
 import os
 
+SAMPLING_FREQUENCY = 50 # Hz
 ROWS_PER_FILE = 60*50*30 # 50 Hz for 30 minutes
+SOURCE_DTYPE = "float64" # type that raw columns are parsed as ("float32" halves memory at the cost of precision)
 
 SPLIT_INTO_CHUNKS = 3
 CHUNK_SIZE, ERR = divmod(ROWS_PER_FILE, SPLIT_INTO_CHUNKS)
@@ -12,6 +14,39 @@ assert not ERR
 OUTLIER_REMOVAL_WINDOW = 60*50*5 # records; this is 5 minutes
 OUTLIER_REMOVAL_SIGMA = 5
 
+USE_CACHE = True # keep converted and QC'd frames as Parquet in results/cache
+CACHE_SIZE_LIMIT = 20 * 2**30 # bytes; least recently used files are evicted beyond this
+CACHE_VERSION = 1 # bump when a change to processing code should invalidate the cache
+
+USE_ARCHIVE = True # read raw files from a compiled campaign archive (src/archive.py) when it is up to date
+ARCHIVE_VERSION = 1 # bump when a change to processing code should invalidate compiled archives
+
+LOADER_CAPACITY = 8 # processed files held in memory by the interactive viewer (~50 MB each)
+
+TRACE_ALLOCATIONS = True # record peak allocation per processing stage (tracemalloc adds some overhead)
+
+SPECTRA_SEGMENT = 2**13 # samples per Welch segment (~164 s), overlapping by half
+SPECTRA_BINS = 40 # log-spaced frequency bins stored per spectrum
+SPECTRA_MAX_MISSING = 0.1 # largest fraction of gap-filled samples for which a spectrum is still computed
+
+STATIONARITY_SUBINTERVALS = 5 # sub-intervals per chunk for the Foken-Wichura covariance test (2 min each)
+STATIONARITY_THRESHOLD = 0.3 # largest relative sub-interval covariance deviation accepted as stationary (classes 1-2 of Foken et al. 2004)
+
+SIDE_OUTPUTS = ["spectra", "periods"] # per-chunk array results, saved separately from the summary table
+
+AVERAGING_PERIODS = [5, 10, 30] # minutes; means and (co)variances over each are tabulated alongside the chunk summaries
+
+STREAM_FILES = False # summarize files chunk by chunk to bound worker memory (QC then redoes the window overlap)
+
+READER_THREADS = 4 # threads in the main process reading raw files ahead of the pool workers
+PREFETCH_FILES = 16 # most raw files held in memory waiting for a worker (~10 MB each compressed)
+
+FILE_TIMEOUT = 600 # seconds a worker may spend on one raw file before the pool is restarted without it
+FILE_RETRIES = 2 # extra attempts for a file after a timeout or transient I/O error; files failing after that are quarantined
+
+FOLLOW_INTERVAL = 10 # seconds between polls of the data directories in --follow mode
+FOLLOW_SETTLE = 60 # seconds a raw file must go unmodified before --follow takes it as complete
+
 NPROC = max(os.cpu_count() - 1, 1)
 
 LOCATION = Location(latitude=33.59, longitude=-102.03, elevation=1014., timezone="US/Central")
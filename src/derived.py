@@ -0,0 +1,126 @@
+import windprofiles.lib.atmos as atmos
+from dataclasses import dataclass
+from typing import Callable
+import pandas as pd
+import numpy as np
+import re
+
+
+@dataclass(frozen = True)
+class Rule:
+    name: str
+    inputs: tuple[str, ...]
+    compute: Callable[..., np.ndarray] # (rows x booms) blocks of the inputs -> (rows x booms) block
+
+
+RULES = {}
+
+
+def rule(name: str, *inputs: str):
+    def register(compute):
+        RULES[name] = Rule(name, inputs, compute)
+        return compute
+    return register
+
+
+@rule("es", "t")
+def saturation_vapor_pressure(t):
+    return atmos.saturation_vapor_pressure(t)
+
+@rule("e", "rh", "es")
+def water_partial_pressure(rh, es):
+    return atmos.water_partial_pressure(rh, es)
+
+@rule("r", "e", "p")
+def water_air_mixing_ratio(e, p):
+    return atmos.water_air_mixing_ratio(e, p)
+
+@rule("q", "r")
+def specific_humidity(r):
+    return atmos.specific_humidity(r)
+
+@rule("vt", "t", "r")
+def virtual_temperature(t, r):
+    return atmos.virtual_temperature(t, r)
+
+@rule("pt", "t", "p")
+def potential_temperature(t, p):
+    return atmos.potential_temperature(t, p)
+
+@rule("vpt", "pt", "r")
+def virtual_potential_temperature(pt, r):
+    return atmos.virtual_potential_temperature(pt, r)
+
+@rule("ws", "u", "v")
+def wind_speed(u, v):
+    return np.hypot(u, v)
+
+
+FLUCTUATION_PRODUCT = re.compile(r"([^']+)'([^']+)'") # e.g. w'u', w'vpt'
+
+
+def product_of_fluctuations(a, b):
+    # Product of deviations from the chunk means, e.g. w'u'
+    return (a - np.nanmean(a, axis = 0)) * (b - np.nanmean(b, axis = 0))
+
+
+def rule_for(name: str) -> Rule | None:
+    if name in RULES:
+        return RULES[name]
+    if (match := FLUCTUATION_PRODUCT.fullmatch(name)) is not None:
+        return Rule(name, match.groups(), product_of_fluctuations)
+    return None
+
+
+def is_derived(name: str) -> bool:
+    return rule_for(name) is not None
+
+
+def requirements(name: str) -> set[str]:
+    # Measured variables that a variable is ultimately computed from
+    if (r := rule_for(name)) is None:
+        return {name}
+    return set().union(*(requirements(i) for i in r.inputs))
+
+
+def east_north(df: pd.DataFrame, booms: list[int]) -> dict[str, np.ndarray]:
+    # Wind components converted from the sonics' (N, W) coordinates to (E, N), as blocks to seed a Chunk with
+    u = df[[f"u_{b}" for b in booms]].to_numpy(dtype = np.float64)
+    v = df[[f"v_{b}" for b in booms]].to_numpy(dtype = np.float64)
+    return {"u" : v, "v" : -u}
+
+
+def streamwise(u: np.ndarray, v: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # (rows x booms) wind components rotated into each boom's mean wind direction over the rows (mean v = 0),
+    # as sonic.align_to_directions does before the summary fluxes are computed
+    theta = np.arctan2(np.nanmean(v, axis = 0), np.nanmean(u, axis = 0))
+    c, s = np.cos(theta), np.sin(theta)
+    return u * c + v * s, v * c - u * s
+
+
+class Chunk:
+    # Variables of one frame for a set of booms, each computed (from measured columns or RULES) only when first
+    # asked for and then kept, so shared intermediates such as r are evaluated once per chunk.
+    def __init__(self, df: pd.DataFrame, booms: list[int], blocks: dict[str, np.ndarray] = None):
+        self.df = df
+        self.booms = booms
+        self.blocks = dict(blocks or {}) # (rows x booms), by variable
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        if name not in self.blocks:
+            if (r := rule_for(name)) is None:
+                self.blocks[name] = self.df[[f"{name}_{b}" for b in self.booms]].to_numpy(dtype = np.float64)
+            else:
+                self.blocks[name] = r.compute(*(self[i] for i in r.inputs))
+        return self.blocks[name]
+
+    def frame(self, variables: list[str]) -> pd.DataFrame:
+        names = [f"{var}_{b}" for var in variables for b in self.booms]
+        return pd.DataFrame(np.hstack([self[var] for var in variables]), index = self.df.index, columns = names)
+
+
+def attach(df: pd.DataFrame, booms: list[int], variables: list[str], blocks: dict[str, np.ndarray] = None) -> pd.DataFrame:
+    # df with the columns of `variables` computed (or replaced, for seeded or measured ones) with a single concat
+    chunk = Chunk(df, booms, blocks)
+    new = chunk.frame(variables)
+    return pd.concat([df.drop(columns = [c for c in new.columns if c in df.columns]), new], axis = 1)
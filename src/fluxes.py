@@ -0,0 +1,90 @@
+# ruff: noqa: F403, F405
+from definitions import *
+import windprofiles.lib.atmos as atmos
+import logging
+import pandas as pd
+import numpy as np
+
+# Variables whose full covariance matrix is computed at each boom. Pairs are named in this order, so the
+# vertical fluxes come out as w'u', w'v', w'vpt', ... as elsewhere in the repo.
+FLUX_VARIABLES = ["w", "u", "v", "vpt", "ts", "q"]
+
+
+def stack_booms(df: pd.DataFrame, booms: list[int], variables: list[str]) -> np.ndarray:
+    # (rows x booms x variables) array
+    names = [f"{var}_{b}" for b in booms for var in variables]
+    return df[names].to_numpy(dtype = np.float64).reshape(len(df), len(booms), len(variables))
+
+
+def cross_moments(X: np.ndarray, blocks: int = 1, shift: np.ndarray = None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # Pairwise-complete sums over `blocks` consecutive row blocks of a (rows x booms x variables) array, each
+    # (blocks x booms x variables x variables): n[.,b,i,j] rows where both i and j are valid, s[.,b,i,j] sum of x_i
+    # over those rows, p[.,b,i,j] sum of x_i*x_j. Values are shifted by `shift` (per boom and variable; the mean if not
+    # given), which is returned so that sums from separate calls can be combined. No per-product columns are made.
+    rows, B, K = X.shape
+    per = -(-rows // blocks)
+    if per * blocks != rows:
+        X = np.concatenate([X, np.full((per * blocks - rows, B, K), np.nan)])
+    valid = np.isfinite(X)
+    if shift is None:
+        shift = np.where(valid, X, 0.).sum(axis = 0) / np.maximum(valid.sum(axis = 0), 1)
+    Y = np.where(valid, X - shift, 0.).reshape(blocks, per, B, K).transpose(0, 2, 3, 1) # (blocks x booms x variables x rows)
+    V = valid.astype(np.float64).reshape(blocks, per, B, K).transpose(0, 2, 3, 1)
+    n = V @ V.swapaxes(-1, -2)
+    s = Y @ V.swapaxes(-1, -2)
+    p = Y @ Y.swapaxes(-1, -2)
+    return n, s, p, shift
+
+
+def covariances(n: np.ndarray, s: np.ndarray, p: np.ndarray, shift: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Means (... x variables) and pairwise-complete population covariance matrices (... x variables x variables)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        mi = s / n # mean of x_i over rows where x_j is also valid
+        mj = s.swapaxes(-1, -2) / n
+        cov = p / n - mi * mj
+        means = np.diagonal(mi, axis1 = -2, axis2 = -1) + shift
+    return means, cov
+
+
+def block_moments(df: pd.DataFrame, booms: list[int], blocks: int = 1) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    return cross_moments(stack_booms(df, booms, FLUX_VARIABLES), blocks)
+
+
+def flux_stats(df: pd.DataFrame, booms: list[int], heights: dict[int, float] = HEIGHTS_DICT, timestamp: pd.Timestamp = None, moments: tuple = None) -> dict:
+    # Second moments and derived turbulence quantities for each boom of a streamwise-aligned chunk.
+    # `moments` are block sums from block_moments on the same chunk, if they have already been computed.
+    logger = logging.getLogger("fluxes")
+    K = len(FLUX_VARIABLES)
+    n, s, p, shift = block_moments(df, booms) if moments is None else moments
+    means, cov = covariances(n.sum(axis = 0), s.sum(axis = 0), p.sum(axis = 0), shift)
+
+    uv = stack_booms(df, booms, ["u", "v"])
+    ws = np.hypot(uv[..., 0], uv[..., 1]) # (rows x booms)
+    ws_mean, ws_rms = np.nanmean(ws, axis = 0), np.nanstd(ws, axis = 0)
+
+    idx = {var : i for i, var in enumerate(FLUX_VARIABLES)}
+    result = {}
+    for k, b in enumerate(booms):
+        C = cov[k]
+        for i in range(K):
+            var = FLUX_VARIABLES[i]
+            result[f"{var}_{b}_var"] = C[i, i]
+            for j in range(i + 1, K):
+                result[f"{var}'{FLUX_VARIABLES[j]}'_{b}_mean"] = C[i, j]
+        for var in ["u", "v", "w"]:
+            result[f"{var}_{b}_rms"] = np.sqrt(C[idx[var], idx[var]])
+        result[f"w_{b}_mean"] = means[k, idx["w"]]
+        result[f"ws_{b}_mean"] = ws_mean[k]
+        result[f"ws_{b}_rms"] = ws_rms[k]
+        result[f"ti_{b}"] = ws_rms[k] / ws_mean[k] # Turbulence intensity
+        result[f"tke_{b}"] = C[idx["u"], idx["u"]] + C[idx["v"], idx["v"]] + C[idx["w"], idx["w"]] # TKE
+
+        wu = C[idx["w"], idx["u"]]
+        if not wu < 0:
+            logger.warning(f"Cannot compute u*, L, sparam for {timestamp}, boom {b} due to non-negative momentum flux ({wu})")
+            continue
+        result[f"u*_{b}"] = np.sqrt(-wu) # Friction velocity
+        result[f"L_{b}"] = atmos.obukhov_length(result[f"u*_{b}"], means[k, idx["vpt"]], C[idx["w"], idx["vpt"]], LOCATION.g) # Obukhov length
+        result[f"sparam_{b}"] = heights[b] / result[f"L_{b}"] # Stability parameter z/L
+
+    return result
@@ -0,0 +1,115 @@
+from contextlib import contextmanager
+import tracemalloc
+import cProfile
+import pstats
+import pandas as pd
+import numpy as np
+import time
+import os
+
+_recorder = None # active Recorder in this process, if any
+
+
+class Recorder:
+    # Wall time, CPU time and peak traced allocation of each stage entered while active. Stages may nest;
+    # a stage's peak allocation is measured relative to the traced memory when it was entered.
+    def __init__(self, trace_allocations: bool = True):
+        self.trace_allocations = trace_allocations
+        self.records = []
+        self.stack = []
+
+    def enter(self, name: str) -> dict:
+        frame = {"stage" : name, "t0" : time.perf_counter(), "c0" : time.process_time(), "m0" : 0, "child_peak" : 0}
+        if self.trace_allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                self.stack[-1]["child_peak"] = max(self.stack[-1]["child_peak"], peak)
+            tracemalloc.reset_peak()
+            frame["m0"] = current
+        self.stack.append(frame)
+        return frame
+
+    def exit(self, frame: dict) -> None:
+        self.stack.pop()
+        record = {"stage" : frame["stage"], "wall" : time.perf_counter() - frame["t0"], "cpu" : time.process_time() - frame["c0"], "peak_alloc_mb" : np.nan}
+        if self.trace_allocations:
+            _, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, frame["child_peak"])
+            record["peak_alloc_mb"] = (peak - frame["m0"]) / 2**20
+            if self.stack: # the parent's peak must still account for this stage
+                self.stack[-1]["child_peak"] = max(self.stack[-1]["child_peak"], peak)
+        self.records.append(record)
+
+
+@contextmanager
+def stage(name: str):
+    # Time the enclosed block as `name` if a recorder is active; otherwise does nothing
+    if _recorder is None:
+        yield
+        return
+    frame = _recorder.enter(name)
+    try:
+        yield
+    finally:
+        _recorder.exit(frame)
+
+
+@contextmanager
+def recording(trace_allocations: bool = True, profile_to: os.PathLike = None):
+    # Activate a recorder for the enclosed block (e.g. one file in a worker), optionally under cProfile
+    global _recorder
+    previous = _recorder
+    _recorder = Recorder(trace_allocations)
+    started = trace_allocations and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    profiler = cProfile.Profile() if profile_to is not None else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield _recorder
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_to)
+        if started:
+            tracemalloc.stop()
+        _recorder = previous
+
+
+def summarize_records(records: pd.DataFrame, slowest: int = 10) -> str:
+    # Text report of per-stage percentiles and the slowest files, from records with columns file, stage, wall, cpu, peak_alloc_mb
+    lines = []
+    if records.empty:
+        return "No stage records collected.\n"
+    lines.append(f"{(records['stage'] == 'file').sum()} files")
+    lines.append("")
+    header = f"{'stage':>24} {'n':>6} {'total (s)':>10} {'p50 (s)':>8} {'p90 (s)':>8} {'p99 (s)':>8} {'max (s)':>8} {'cpu/wall':>8} {'p50 MB':>8} {'max MB':>8}"
+    lines.append(header)
+    for name, group in records.groupby("stage", sort = False):
+        wall = group["wall"]
+        lines.append(
+            f"{name:>24} {len(group):6d} {wall.sum():10.2f} {wall.quantile(0.5):8.3f} {wall.quantile(0.9):8.3f} {wall.quantile(0.99):8.3f} {wall.max():8.3f} "
+            f"{group['cpu'].sum() / max(wall.sum(), 1e-12):8.2f} {group['peak_alloc_mb'].quantile(0.5):8.1f} {group['peak_alloc_mb'].max():8.1f}"
+        )
+    lines.append("")
+    top = records[records["stage"] == "file"].nlargest(slowest, "wall") if "file" in set(records["stage"]) else pd.DataFrame()
+    if not top.empty:
+        lines.append(f"Slowest {len(top)} files:")
+        for _, row in top.iterrows():
+            stages = records[(records["file"] == row["file"]) & (records["stage"] != "file")].groupby("stage", sort = False)["wall"].sum()
+            breakdown = ", ".join(f"{k} {v:.2f}s" for k, v in stages.nlargest(3).items())
+            lines.append(f"  {row['wall']:8.2f} s  {row['file']}  ({breakdown})")
+    return "\n".join(lines) + "\n"
+
+
+def merge_profiles(paths: list[os.PathLike], saveto: os.PathLike, top: int = 50) -> None:
+    # Combine per-task cProfile dumps into one .prof file plus a text listing of the top functions
+    paths = [p for p in paths if os.path.exists(p)]
+    if not paths:
+        return
+    stats = pstats.Stats(*paths)
+    stats.dump_stats(saveto)
+    with open(f"{os.path.splitext(saveto)[0]}.txt", "w") as f:
+        stats.stream = f
+        stats.sort_stats("cumulative").print_stats(top)
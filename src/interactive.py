@@ -1,32 +1,33 @@
 # ruff: noqa: F403, F405, E402
 from definitions import *
-from config import parse, results_dir
-from process import process_file, get_datetime_from_filename
-from datetime import datetime
+from config import parse
+from catalog import Catalog
+from loader import SonicLoader
+from decimate import DecimatedLine, DecimatedScatter
+from legend import ToggleLegend
+import derived
+import store
+from postprocess import profiles_path
 import pandas as pd
 import matplotlib
 matplotlib.use('Qt5Agg')
 import matplotlib.pyplot as plt
 import matplotlib.style as mplstyle
 mplstyle.use('fast')
-from matplotlib.patches import Patch
 from matplotlib.backend_bases import MouseButton
 
-def get_sonic_from_timestamp(ts: datetime, rawpath: os.PathLike, qc: bool):
-    time = ts.astimezone("UTC")
-    offset = time.minute % 30
-    corrected = time - pd.Timedelta(offset, "min")
-
-    daystr = str(corrected.day).zfill(2)
-    parent = os.path.join(rawpath, daystr)
-
-    for file in os.listdir(parent):
-        file_ts = get_datetime_from_filename(file)
-        if file_ts == corrected:
-            filepath = os.path.join(parent, file)
-            return process_file(filepath, qc)[0].iloc[offset*50*60:(offset+CHUNK_TIME)*50*60]
-
-def interactive_plot(df: pd.DataFrame, variable: str, booms: list[int], rawpath: os.PathLike):
+def with_variable(df: pd.DataFrame, variable: str, boom: int) -> pd.DataFrame:
+    # Sonic window with `variable` computed for `boom` if it is derived. Winds are rotated into the window's mean
+    # direction first, so that fluctuation products such as w'u' match the summaries' streamwise-aligned ones.
+    if variable is None or f"{variable}_{boom}" in df.columns or not derived.is_derived(variable):
+        return df
+    blocks = None
+    if derived.requirements(variable) & {"u", "v"}:
+        blocks = derived.east_north(df, [boom])
+        blocks["u"], blocks["v"] = derived.streamwise(blocks["u"], blocks["v"])
+    return derived.attach(df, [boom], [variable], blocks)
+
+def interactive_plot(df: pd.DataFrame, variable: str, booms: list[int], loader: SonicLoader):
     fig, ax = plt.subplots(figsize = (12, 8))
     fig.canvas.manager.set_window_title(f"{FIGVARS[variable]} averaged data")
 
@@ -34,57 +35,63 @@ def interactive_plot(df: pd.DataFrame, variable: str, booms: list[int], rawpath:
 
     colors = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf"]
     booms_by_artists = {}
-    legend_elements = []
-    for b, c in zip(booms, colors):
+    decimated = {}
+    for b in booms:
         y = df[f"{variable}_{b}_mean"]
-        scatter = ax.scatter(x, y, s = 4, picker = True)
-        booms_by_artists[scatter] = b
-        legend_elements.append(Patch(facecolor = c, edgecolor = c, label = f"{FIGVARS[variable]}, boom {b} ({HEIGHTS_DICT[b]} m)"))
-
-    artists_from_legend = {}
-    legend = ax.legend(handles = legend_elements, fancybox = True, shadow = True)
-    legend.set_draggable(True)
+        scatter = DecimatedScatter(ax, x, y, s = 4, picker = True)
+        booms_by_artists[scatter.artist] = b
+        decimated[scatter.artist] = scatter
 
-    for legend_artist, boom_artist in zip(legend.get_patches(), booms_by_artists.keys()):
-        legend_artist.set_picker(True)
-        artists_from_legend[legend_artist] = boom_artist
+    ToggleLegend(ax, list(booms_by_artists), [f"{FIGVARS[variable]}, boom {b} ({HEIGHTS_DICT[b]} m)" for b in booms], colors)
 
     ax.set_ylabel(f"{FIGVARS[variable]} ({FIGUNITS[variable]})")
     ax.set_xlabel("time")
 
+    loading = set()
+    timers = []
+    indicator = ax.text(0.01, 0.99, "", transform = ax.transAxes, ha = "left", va = "top", color = "gray")
+
+    def set_loading_indicator():
+        indicator.set_text(f"Loading {len(loading)} sonic window{'s' if len(loading) > 1 else ''}..." if loading else "")
+        fig.canvas.draw_idle()
+
+    def show_window(window, boom, timestamp, qc):
+        if window.cancelled():
+            return
+        if (e := window.exception()) is not None:
+            print(f"Failed to load sonic data at {timestamp}: {e}")
+            return
+        sonic_subplot(with_variable(window.result(), variable, boom), variable, boom, timestamp, qc)
+
     def onpick(event):
         artist = event.artist
         button = event.mouseevent.button
         if artist in booms_by_artists.keys():
             qc = (button == MouseButton.LEFT)
             boom = booms_by_artists[artist]
-            timestamp = x[event.ind][0]
+            timestamp = x[decimated[artist].indices[event.ind]][0]
+            if (window := loader.window(timestamp, qc, variable, boom)) is None:
+                print(f"No raw file found for {timestamp}")
+                return
+            if window.done(): # already in memory
+                show_window(window, boom, timestamp, qc)
+                return
             print(f"Loading sonic {FIGVARS[variable]} data for boom {boom} at {timestamp}")
-            sonic_subplot(get_sonic_from_timestamp(timestamp, rawpath, qc), variable, boom, timestamp, qc)
-        elif artist in artists_from_legend.keys():
-            boom_artist = artists_from_legend[artist]
-            if button == MouseButton.LEFT:
-                visible = not boom_artist.get_visible()
-                boom_artist.set_visible(visible)
-                artist.set_alpha(1.0 if visible else 0.2)
-            elif button == MouseButton.RIGHT:
-                boom_artist.set_visible(True)
-                artist.set_alpha(1.0)
-                for Lart, Bart in artists_from_legend.items():
-                    if Lart != artist:
-                        Bart.set_visible(False)
-                        Lart.set_alpha(0.2)
-            fig.canvas.draw()
-
-    def onkey(event):
-        if event.key == " ": # Set all visible on spacebar press
-            for Lart, Bart in artists_from_legend.items():
-                Bart.set_visible(True)
-                Lart.set_alpha(1.0)
-            fig.canvas.draw()
+            loading.add(window)
+            set_loading_indicator()
+            timer = fig.canvas.new_timer(interval = 100)
+            def poll():
+                if window.done():
+                    timer.stop()
+                    timers.remove(timer)
+                    loading.discard(window)
+                    set_loading_indicator()
+                    show_window(window, boom, timestamp, qc)
+            timer.add_callback(poll)
+            timers.append(timer) # keep a reference until the load finishes
+            timer.start()
 
     fig.canvas.mpl_connect("pick_event", onpick)
-    fig.canvas.mpl_connect("key_press_event", onkey)
 
     plt.show(block = False)
 
@@ -92,7 +99,7 @@ def sonic_subplot(dfs, variable, boom, time, qc):
     fig, ax = plt.subplots(figsize = (10, 7))
     fig.canvas.manager.set_window_title(f"Sonic {variable}, boom {boom}, {time}")
 
-    ax.plot(dfs.index, dfs[f"{variable}_{boom}"], linewidth = 1)
+    DecimatedLine(ax, dfs.index, dfs[f"{variable}_{boom}"], linewidth = 1)
 
     ax.set_title(f"{FIGVARS[variable]}, boom {boom} ({HEIGHTS_DICT[boom]} meters)" + (" *NO QC*" if not qc else ""))
     ax.set_xlabel(f"collections since {time}")
@@ -112,66 +119,29 @@ def normal_plot(df, variable, booms): # right now assume dimless
 
         colors = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf"]
 
-        booms_by_artists = {}
-        legend_elements = []
-        for b, c in zip(booms, colors):
-            y = df[f"ti_{b}"]
-            scatter = ax.scatter(df.index, y, s = 4, picker = True)
-            booms_by_artists[scatter] = b
-            legend_elements.append(Patch(facecolor = c, edgecolor = c, label = f"Boom {b} ({HEIGHTS_DICT[b]}m)"))
-
-        artists_from_legend = {}
-        legend = ax.legend(handles = legend_elements, fancybox = True, shadow = True)
-        legend.set_draggable(True)
-
-        for legend_artist, boom_artist in zip(legend.get_patches(), booms_by_artists.keys()):
-            legend_artist.set_picker(True)
-            artists_from_legend[legend_artist] = boom_artist
-
-        def onpick(event):
-            artist = event.artist
-            if artist in artists_from_legend.keys():
-                boom_artist = artists_from_legend[artist]
-                button = event.mouseevent.button
-                if button == MouseButton.LEFT:
-                    visible = not boom_artist.get_visible()
-                    boom_artist.set_visible(visible)
-                    artist.set_alpha(1.0 if visible else 0.2)
-                elif button == MouseButton.RIGHT:
-                    boom_artist.set_visible(True)
-                    artist.set_alpha(1.0)
-                    for Lart, Bart in artists_from_legend.items():
-                        if Lart != artist:
-                            Bart.set_visible(False)
-                            Lart.set_alpha(0.2)
-                fig.canvas.draw()
-
-        def onkey(event):
-            if event.key == " ": # Set all visible on spacebar press
-                for Lart, Bart in artists_from_legend.items():
-                    Bart.set_visible(True)
-                    Lart.set_alpha(1.0)
-                fig.canvas.draw()
-
-        fig.canvas.mpl_connect("pick_event", onpick)
-        fig.canvas.mpl_connect("key_press_event", onkey)
+        scatters = [DecimatedScatter(ax, df.index, df[f"ti_{b}"], s = 4, picker = True).artist for b in booms]
+        ToggleLegend(ax, scatters, [f"Boom {b} ({HEIGHTS_DICT[b]}m)" for b in booms], colors)
 
     else:
-        ax.scatter(df.index, df[variable], s = 5)
+        DecimatedScatter(ax, df.index, df[variable], s = 5)
 
     ax.set_xlabel("Time")
     ax.set_ylabel(NIFIGVARS[variable])
     plt.show(block = False)
 
-def interact_CLI(df: pd.DataFrame, rawpath: os.PathLike): # DOES NOT CURRENTLY WORK (b/c process w/o summarize doesn't generate) FOR FLUX QUANTITIES 
+def interact_CLI(df: pd.DataFrame, catalog: Catalog):
+    loader = SonicLoader(catalog)
     print("Entered interactive plotting mode. Respond to an input with QUIT to exit, HELP to see variables, or TABLE to print data.")
     while True:
         try:
             user_in = input("Enter name of variable to plot: ").strip().lower()
             if user_in in FIGVARS.keys():
                 print(f"Plotting {FIGVARS[user_in]}.")
-                interactive_plot(df, user_in, BOOMS, rawpath)
+                interactive_plot(df, user_in, BOOMS, loader)
             elif user_in in NIFIGVARS.keys():
+                if user_in != "ti" and user_in not in df.columns:
+                    print(f"{NIFIGVARS[user_in]} has not been computed; run postprocess.py first.")
+                    continue
                 normal_plot(df, user_in, BOOMS)
             elif user_in in {"quit", "exit", "qq"}:
                 break
@@ -183,6 +153,7 @@ def interact_CLI(df: pd.DataFrame, rawpath: os.PathLike): # DOES NOT CURRENTLY W
                 print(f"Unrecognized variable '{user_in}'.")
         except KeyboardInterrupt:
             break
+    loader.shutdown()
 
 def main():
     args = parse("interact")
@@ -193,13 +164,11 @@ def main():
         raise KeyError(f"{selection} not in process keys")
     
     rawpath = os.path.join(args["data"], dirs[selection])
-    procpath = os.path.join(results_dir, "testing" if args["test"] else "processed", f"{selection}.csv")
-
-    df = pd.read_csv(procpath)
-    df["time"] = pd.to_datetime(df["time"])
-    df.set_index("time", inplace = True)
+    df = store.load(selection, store.store_dir(args["test"]))
+    if os.path.exists(profiles := profiles_path(selection, args["test"])): # alpha and ri_bulk, from postprocess.py
+        df = df.join(pd.read_parquet(profiles).set_index("time"))
 
-    interact_CLI(df, rawpath)
+    interact_CLI(df, Catalog(selection, rawpath))
 
 
 if __name__ == "__main__":
@@ -1,9 +1,10 @@
 import os
-import pandas as pd
 from config import results_dir
 import matplotlib.pyplot as plt
+import store
 
-processed = os.path.join(results_dir, "processed", "dec18.csv")
+CAMPAIGN = "dec18"
+BOOMS = [1,2,3,4,5,6,7,9]
 fig_out = os.path.join(results_dir, "figures")
 
 def turbulence_distribution(df, b, saveto):
@@ -27,9 +28,9 @@ def turbulence_scatter(df, b):
     plt.show()
 
 def main():
-    df = pd.read_csv(processed)
+    df = store.load(CAMPAIGN, store.store_dir(), columns = [f"{var}_{b}" for var in ["ti", "tke"] for b in BOOMS])
 
-    for b in [1,2,3,4,5,6,7,9]:
+    for b in BOOMS:
         turbulence_distribution(df, b, os.path.join(fig_out, f"turbulence_{b}.png"))
 
     turbulence_scatter(df, 1)
@@ -0,0 +1,168 @@
+# ruff: noqa: F403, F405
+from definitions import *
+from config import parent_dir
+import pandas as pd
+import importlib.metadata
+import hashlib
+import sqlite3
+import pickle
+import json
+import os
+
+FINGERPRINT_SOURCES = ["process.py", "catalog.py", "cache.py", "archive.py", "outliers.py", "fluxes.py", "autocorr.py", "spectra.py", "periods.py", "stationarity.py", "derived.py"]
+
+
+def settings() -> dict:
+    # The definitions that change summary rows; runtime knobs (threads, timeouts, cache and loader sizes, ...) are left out
+    return {
+        "sampling_frequency" : SAMPLING_FREQUENCY,
+        "rows_per_file" : ROWS_PER_FILE,
+        "dtype" : SOURCE_DTYPE,
+        "chunks" : SPLIT_INTO_CHUNKS,
+        "qc" : [OUTLIER_REMOVAL_WINDOW, OUTLIER_REMOVAL_SIGMA],
+        "spectra" : [SPECTRA_SEGMENT, SPECTRA_BINS, SPECTRA_MAX_MISSING],
+        "stationarity" : [STATIONARITY_SUBINTERVALS, STATIONARITY_THRESHOLD],
+        "averaging_periods" : AVERAGING_PERIODS,
+        "location" : [LOCATION.g, LOCATION.timezone],
+        "source_timezone" : SOURCE_TIMEZONE,
+        "units" : SOURCE_UNITS,
+        "header_map" : HEADER_MAP,
+        "heights" : ALL_HEIGHTS_DICT,
+        "drop_booms" : DROP_BOOMS,
+    }
+
+
+def code_fingerprint() -> str:
+    # Hash of everything that determines the summary rows; a change means ledger entries are stale
+    h = hashlib.sha1(json.dumps(settings(), sort_keys = True, default = str).encode())
+    for name in FINGERPRINT_SOURCES:
+        with open(os.path.join(parent_dir, "src", name), "rb") as f:
+            h.update(f.read())
+    try:
+        h.update(importlib.metadata.version("windprofiles").encode())
+    except importlib.metadata.PackageNotFoundError:
+        pass
+    return h.hexdigest()
+
+
+class Ledger:
+    # Per-raw-file record of summary rows, so that runs can be resumed and only stale files recomputed
+    def __init__(self, path: os.PathLike):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                campaign TEXT NOT NULL,
+                path TEXT NOT NULL,
+                mtime INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                fingerprint TEXT NOT NULL,
+                rows BLOB NOT NULL,
+                PRIMARY KEY (campaign, path)
+            )
+        """)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def reset(self, campaign: str, filepaths: list[os.PathLike] = None) -> None:
+        # Forgets a campaign's entries, or only those of the given raw files
+        if filepaths is None:
+            self.conn.execute("DELETE FROM files WHERE campaign = ?", (campaign,))
+        else:
+            self.conn.executemany("DELETE FROM files WHERE campaign = ? AND path = ?", [(campaign, os.path.abspath(f)) for f in filepaths])
+        self.conn.commit()
+
+    def is_done(self, campaign: str, filepath: os.PathLike, fingerprint: str) -> bool:
+        try:
+            stat = os.stat(filepath)
+        except OSError: # gone since it was listed; left for the worker to report
+            return False
+        row = self.conn.execute(
+            "SELECT mtime, size, fingerprint FROM files WHERE campaign = ? AND path = ?",
+            (campaign, os.path.abspath(filepath))
+        ).fetchone()
+        return row == (stat.st_mtime_ns, stat.st_size, fingerprint)
+
+    def record(self, campaign: str, filepath: os.PathLike, fingerprint: str, rows: list[dict]) -> None:
+        try:
+            stat = os.stat(filepath)
+            mtime, size = stat.st_mtime_ns, stat.st_size
+        except OSError: # gone since it was summarized: keep the rows, but never count the entry as up to date
+            mtime, size = -1, -1
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+            (campaign, os.path.abspath(filepath), mtime, size, fingerprint, pickle.dumps(rows))
+        )
+        self.conn.commit() # commit per file so that a crash loses at most the files in flight
+
+    def rows(self, campaign: str, filepaths: list[os.PathLike] = None):
+        # Recorded rows for a campaign, optionally restricted to the given raw files (drops entries for removed files)
+        keep = None if filepaths is None else {os.path.abspath(f) for f in filepaths}
+        for path, blob in self.conn.execute("SELECT path, rows FROM files WHERE campaign = ?", (campaign,)):
+            if keep is None or path in keep:
+                yield from pickle.loads(blob)
+
+    def side_output(self, campaign: str, key: str, filepaths: list[os.PathLike] = None) -> tuple[list, list]:
+        # Times and values of a non-tabular entry (e.g. spectra arrays) of each row
+        times, values = [], []
+        for row in self.rows(campaign, filepaths):
+            if key in row:
+                times.append(row["time"])
+                values.append(row[key])
+        return times, values
+
+    def frame(self, campaign: str, filepaths: list[os.PathLike] = None, exclude: list[str] = ()) -> pd.DataFrame:
+        # Summary table for a campaign, leaving out the `exclude` entries of each row
+        rows = [{k : v for k, v in row.items() if k not in exclude} for row in self.rows(campaign, filepaths)]
+        df = pd.DataFrame(rows)
+        if df.empty:
+            return df
+        df["time"] = pd.to_datetime(df["time"])
+        df.set_index("time", inplace=True)
+        df.sort_index(ascending=True, inplace=True)
+        return df
+
+
+class Quarantine:
+    # Manifest of raw files that kept failing, which later runs skip until the file itself changes
+    def __init__(self, path: os.PathLike):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.files = json.load(f)
+        except FileNotFoundError:
+            self.files = {}
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def holds(self, filepath: os.PathLike) -> bool:
+        # A file that is missing or unreadable is not held, so that it is tried (and its error reported) again
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return False
+        entry = self.files.get(os.path.abspath(filepath))
+        return entry is not None and (entry["mtime"], entry["size"]) == (stat.st_mtime_ns, stat.st_size)
+
+    def add(self, campaign: str, filepath: os.PathLike, error: str) -> None:
+        # The file may have failed because it disappeared or became unreadable; it is then recorded without mtime and size
+        try:
+            stat = os.stat(filepath)
+            mtime, size = stat.st_mtime_ns, stat.st_size
+        except OSError:
+            mtime, size = None, None
+        self.files[os.path.abspath(filepath)] = {"campaign" : campaign, "mtime" : mtime, "size" : size, "error" : error}
+        self.save()
+
+    def release(self, filepath: os.PathLike) -> None:
+        if self.files.pop(os.path.abspath(filepath), None) is not None:
+            self.save()
+
+    def save(self) -> None:
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.files, f, indent=2)
+        os.replace(tmp, self.path)
@@ -0,0 +1,69 @@
+from matplotlib.patches import Patch
+from matplotlib.backend_bases import MouseButton
+
+HIDDEN_ALPHA = 0.2 # legend patch alpha of a hidden artist
+
+
+class ToggleLegend:
+    # Legend whose entries show and hide their artists: left click toggles one, right click shows only that one,
+    # and spacebar shows all. The artists and legend are animated, so a toggle restores the background cached at
+    # the last full draw and blits just them instead of re-rendering the figure (saved figures still include them).
+    def __init__(self, ax, artists: list, labels: list[str], colors: list[str]):
+        self.fig = ax.figure
+        self.canvas = ax.figure.canvas
+        handles = [Patch(facecolor = c, edgecolor = c, label = label) for label, c in zip(labels, colors)]
+        self.legend = ax.legend(handles = handles, fancybox = True, shadow = True)
+        self.legend.set_draggable(True)
+        self.legend.set_animated(True)
+
+        self.artists_from_legend = {}
+        for legend_artist, artist in zip(self.legend.get_patches(), artists):
+            legend_artist.set_picker(True)
+            artist.set_animated(True)
+            self.artists_from_legend[legend_artist] = artist
+
+        self.background = None
+        # lambdas rather than bound methods, since the canvas only holds weak references to methods
+        self.canvas.mpl_connect("draw_event", lambda event : self.on_draw())
+        self.canvas.mpl_connect("pick_event", lambda event : self.on_pick(event))
+        self.canvas.mpl_connect("key_press_event", lambda event : self.on_key(event))
+
+    def draw_animated(self) -> None:
+        for artist in self.artists_from_legend.values():
+            self.fig.draw_artist(artist)
+        self.fig.draw_artist(self.legend)
+
+    def on_draw(self) -> None:
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_animated()
+
+    def redraw(self) -> None:
+        if self.background is None: # not drawn yet
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        self.draw_animated()
+        self.canvas.blit(self.fig.bbox)
+        self.canvas.flush_events()
+
+    def set_shown(self, legend_artist, visible: bool) -> None:
+        self.artists_from_legend[legend_artist].set_visible(visible)
+        legend_artist.set_alpha(1.0 if visible else HIDDEN_ALPHA)
+
+    def on_pick(self, event) -> None:
+        artist = event.artist
+        if artist not in self.artists_from_legend:
+            return
+        button = event.mouseevent.button
+        if button == MouseButton.LEFT:
+            self.set_shown(artist, not self.artists_from_legend[artist].get_visible())
+        elif button == MouseButton.RIGHT:
+            for legend_artist in self.artists_from_legend:
+                self.set_shown(legend_artist, legend_artist is artist)
+        self.redraw()
+
+    def on_key(self, event) -> None:
+        if event.key == " ": # Set all visible on spacebar press
+            for legend_artist in self.artists_from_legend:
+                self.set_shown(legend_artist, True)
+            self.redraw()
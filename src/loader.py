@@ -0,0 +1,84 @@
+# ruff: noqa: F403, F405
+from definitions import *
+from process import process_file
+from catalog import Catalog
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict
+import derived
+import pandas as pd
+import threading
+
+
+class SonicLoader:
+    # Loads processed sonic files on background threads, keeping the most recently used `capacity` frames in memory
+    # keyed by (file, qc flag, variables, booms), where a window for one variable and boom only loads the columns it
+    # needs. Loading mostly happens in pyarrow/NumPy, which release the GIL.
+    def __init__(self, catalog: Catalog, capacity: int = LOADER_CAPACITY, workers: int = 2):
+        self.catalog = catalog
+        self.capacity = capacity
+        self.executor = ThreadPoolExecutor(workers)
+        self.frames = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def subset(variable: str = None, boom: int = None) -> tuple[tuple[str, ...] | None, tuple[int, ...] | None]:
+        # Columns (variables, booms) to load for a window of `variable` at `boom`: the variable itself if measured, or
+        # what it is computed from if derived (both wind components if either, for the coordinate change); None for all
+        if variable is None or boom is None:
+            return None, None
+        if derived.is_derived(variable):
+            inputs = derived.requirements(variable)
+            if inputs & {"u", "v"}:
+                inputs |= {"u", "v"}
+            return tuple(sorted(inputs)), (boom,)
+        if variable in HEADER_MAP.values():
+            return (variable,), (boom,)
+        return None, None
+
+    def request(self, filepath: os.PathLike, qc: bool, variables: tuple[str, ...] = None, booms: tuple[int, ...] = None) -> Future:
+        key = (filepath, qc, variables, booms)
+        with self.lock:
+            if key not in self.frames and (filepath, qc, None, None) in self.frames: # the whole frame is as good as a subset
+                key = (filepath, qc, None, None)
+            if key in self.frames:
+                self.frames.move_to_end(key)
+                return self.frames[key]
+            future = self.executor.submit(lambda : process_file(filepath, qc, variables = None if variables is None else list(variables), booms = None if booms is None else list(booms))[0])
+            self.frames[key] = future
+            while len(self.frames) > self.capacity:
+                _, oldest = self.frames.popitem(last = False)
+                oldest.cancel() # no-op if already running or done
+            return future
+
+    def prefetch(self, start: pd.Timestamp, qc: bool, neighbours: int = 1, variables: tuple[str, ...] = None, booms: tuple[int, ...] = None) -> None:
+        # Speculatively load the half-hours either side of the file starting at `start`
+        for i in range(1, neighbours + 1):
+            for sign in [1, -1]:
+                if (filepath := self.catalog.lookup(start + sign * i * pd.Timedelta(30, "min"))) is not None:
+                    self.request(filepath, qc, variables, booms)
+
+    def window(self, time: pd.Timestamp, qc: bool, variable: str = None, boom: int = None, prefetch: int = 1) -> Future | None:
+        # Future resolving to the CHUNK_TIME-minute window of sonic data beginning at `time`, with the columns
+        # `variable` at `boom` needs (all columns if not given)
+        time = pd.Timestamp(time).tz_convert("UTC")
+        filepath, start = self.catalog.containing(time)
+        if filepath is None:
+            return None
+        offset = int((time - start) / pd.Timedelta(1, "min"))
+        variables, booms = self.subset(variable, boom)
+        frame = self.request(filepath, qc, variables, booms)
+        self.prefetch(start, qc, prefetch, variables, booms)
+
+        window = Future()
+        def done(f: Future):
+            if f.cancelled():
+                window.cancel()
+            elif (e := f.exception()) is not None:
+                window.set_exception(e)
+            else:
+                window.set_result(f.result().iloc[offset*50*60:(offset+CHUNK_TIME)*50*60])
+        frame.add_done_callback(done)
+        return window
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait = False, cancel_futures = True)
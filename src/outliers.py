@@ -0,0 +1,247 @@
+# ruff: noqa: F403, F405
+from definitions import *
+import windprofiles.process as process
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import numpy as np
+import time
+try:
+    import numba
+except ImportError: # optional; the NumPy implementation is used without it
+    numba = None
+
+QC_COLUMN_TYPES = ["u", "v", "t", "ts", "p", "rh"]
+
+
+def window_sums(a: np.ndarray, window: int, center: bool) -> np.ndarray:
+    # Sum of each column of a (rows x columns) array over every row's rolling window (placed as pandas' rolling places it),
+    # as the difference of two contiguous slices of one cumulative sum. The sum is laid out with `window` rows of zeros
+    # before it and its total repeated after it, so windows running over either edge need no special handling.
+    n, m = a.shape
+    lead = (window - 1) // 2 if center else 0 # rows after a row in its window
+    c = np.empty((window + n + lead + 1, m), dtype = np.float64, order = "F")
+    c[:window + 1] = 0.
+    np.cumsum(a, axis = 0, out = c[window + 1:window + n + 1])
+    c[window + n + 1:] = c[window + n]
+    return c[window + lead + 1:window + lead + n + 1] - c[lead + 1:lead + n + 1]
+
+
+def window_counts(valid: np.ndarray, window: int, center: bool) -> np.ndarray:
+    # Valid values in every row's window; when nothing is missing this is the same for all columns and needs no sums
+    if not valid.all():
+        return window_sums(valid.astype(np.float64), window, center)
+    n = valid.shape[0]
+    end = np.arange(1, n + 1) + ((window - 1) // 2 if center else 0)
+    return (np.minimum(end, n) - np.maximum(end - window, 0)).astype(np.float64)[:, None] * np.ones((1, valid.shape[1]), order = "F")
+
+
+def shifted(x: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Columns minus their mean (0 where missing), so that sums of squares do not lose precision, with the valid mask
+    # and the shift. Arrays are column-contiguous, which keeps the running sums down columns fast.
+    x = np.asfortranarray(x)
+    valid = ~np.isnan(x)
+    y = np.where(valid, x, 0.)
+    shift = y.sum(axis = 0) / np.maximum(valid.sum(axis = 0), 1)
+    y -= shift
+    y[~valid] = 0.
+    return y, valid, shift
+
+
+def rolling_moments(x: np.ndarray, window: int, center: bool = True, min_periods: int = 1, block: int = 4) -> tuple[np.ndarray, np.ndarray]:
+    # NaN-aware rolling mean and (ddof=1) standard deviation of each column of a (rows x columns) array, in O(n).
+    # Columns are done `block` at a time so that the temporaries stay in cache.
+    x = np.asfortranarray(x, dtype = np.float64)
+    mean, std = np.empty_like(x, order = "F"), np.empty_like(x, order = "F")
+    for i in range(0, x.shape[1], block):
+        cols = slice(i, i + block)
+        y, valid, shift = shifted(x[:, cols])
+        count = window_counts(valid, window, center)
+        m = window_sums(y, window, center)
+        v = window_sums(np.square(y, out = y), window, center)
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            m /= count
+            np.multiply(m, m, out = y)
+            y *= count
+            v -= y
+            np.maximum(v, 0., out = v)
+            v /= count - 1.
+            np.sqrt(v, out = v)
+        m += shift
+        m[count < max(min_periods, 1)] = np.nan
+        v[count < max(min_periods, 2)] = np.nan
+        mean[:, cols], std[:, cols] = m, v
+    return mean, std
+
+
+def outlier_mask(x: np.ndarray, window: int, sigma: float, center: bool = True, min_periods: int = 1) -> np.ndarray:
+    # Values more than `sigma` rolling standard deviations from the rolling mean, compared as squares in the shifted
+    # frame and computed in place, so that the only temporaries are the three window sums and one scratch array
+    y, valid, _ = shifted(x)
+    count = window_counts(valid, window, center)
+    mean = window_sums(y, window, center)
+    var = window_sums(np.square(y), window, center)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        mean /= count
+        scratch = np.multiply(mean, mean)
+        scratch *= count
+        var -= scratch
+        np.maximum(var, 0., out = var)
+        if min_periods > 2: # otherwise count > 1 (needed for a standard deviation) is the stricter condition
+            var[count < min_periods] = np.nan
+        count -= 1.
+        var /= count # inf or NaN where count <= 1, so those values are never flagged
+        var *= sigma**2
+        np.subtract(y, mean, out = scratch)
+        np.square(scratch, out = scratch)
+        mask = scratch > var # NaN comparisons are False
+    mask &= valid # missing values are never flagged
+    return mask
+
+
+if numba is not None:
+    @numba.njit(parallel = True, cache = True)
+    def _outlier_mask_kernel(x, window, lead, sigma, min_periods, mask):
+        # One pass down each column of x (rows x columns, column-contiguous), keeping the count and the sums of the shifted
+        # values and their squares over the window as rows enter and leave it; columns are spread over numba's threads
+        n, m = x.shape
+        for j in numba.prange(m):
+            total, valid = 0., 0
+            for i in range(n):
+                if not np.isnan(x[i, j]):
+                    total += x[i, j]
+                    valid += 1
+            shift = total / max(valid, 1)
+            count, s1, s2 = 0, 0., 0.
+            for i in range(min(lead, n)): # the rows after row 0 in its window
+                if not np.isnan(x[i, j]):
+                    y = x[i, j] - shift
+                    count, s1, s2 = count + 1, s1 + y, s2 + y * y
+            for i in range(n):
+                if i + lead < n and not np.isnan(x[i + lead, j]): # entering
+                    y = x[i + lead, j] - shift
+                    count, s1, s2 = count + 1, s1 + y, s2 + y * y
+                if i + lead - window >= 0 and not np.isnan(x[i + lead - window, j]): # leaving
+                    y = x[i + lead - window, j] - shift
+                    count, s1, s2 = count - 1, s1 - y, s2 - y * y
+                if count >= min_periods and count > 1 and not np.isnan(x[i, j]):
+                    mean = s1 / count
+                    var = max(s2 - s1 * mean, 0.) / (count - 1)
+                    d = x[i, j] - shift - mean
+                    mask[i, j] = d * d > sigma * sigma * var
+
+
+def outlier_mask_compiled(x: np.ndarray, window: int, sigma: float, center: bool = True, min_periods: int = 1, threads: int = 1) -> np.ndarray:
+    # outlier_mask using the numba kernel (numba must be installed)
+    x = np.asfortranarray(x, dtype = np.float64)
+    mask = np.zeros(x.shape, dtype = np.bool_, order = "F")
+    numba.set_num_threads(max(1, min(threads, numba.config.NUMBA_NUM_THREADS)))
+    _outlier_mask_kernel(x, window, (window - 1) // 2 if center else 0, float(sigma), max(min_periods, 1), mask)
+    return mask
+
+
+def rolling_outlier_removal(df: pd.DataFrame, window_size_observations: int = OUTLIER_REMOVAL_WINDOW, sigma: float = OUTLIER_REMOVAL_SIGMA,
+                            column_types: list[str] = QC_COLUMN_TYPES, center: bool = True, min_periods: int = 1,
+                            block: int = 4, threads: int = 1, compiled: bool = numba is not None) -> tuple[pd.DataFrame, dict[str, int]]:
+    # Blank out values more than `sigma` rolling standard deviations from the rolling mean, column by column.
+    # With numba, one compiled pass per column over `threads` threads; otherwise columns are handled in blocks of
+    # `block` so that temporaries stay in cache, and blocks can be spread over `threads` threads.
+    columns = [col for col in df.columns if col.split("_")[0] in column_types]
+    x = np.asfortranarray(df[columns].to_numpy(dtype = np.float64, copy = True)) # column-contiguous, for the running sums
+
+    def clean(cols: slice) -> np.ndarray:
+        if compiled:
+            mask = outlier_mask_compiled(x[:, cols], window_size_observations, sigma, center, min_periods, threads)
+        else:
+            mask = outlier_mask(x[:, cols], window_size_observations, sigma, center, min_periods)
+        x[:, cols][mask] = np.nan
+        return mask.sum(axis = 0)
+
+    if compiled:
+        counts = [clean(slice(0, len(columns)))]
+    elif threads > 1:
+        with ThreadPoolExecutor(threads) as executor:
+            counts = list(executor.map(clean, [slice(i, min(i + block, len(columns))) for i in range(0, len(columns), block)]))
+    else:
+        counts = [clean(slice(i, min(i + block, len(columns)))) for i in range(0, len(columns), block)]
+
+    cleaned = pd.DataFrame(x, index = df.index, columns = columns, copy = False) # rather than copying df and setting columns one by one
+    df = pd.concat([df.drop(columns = columns), cleaned], axis = 1)[list(df.columns)]
+    elims = {col : int(val) for col, val in zip(columns, np.concatenate(counts) if counts else [])}
+    return df, elims
+
+
+def pandas_reference(df: pd.DataFrame, window_size_observations: int = OUTLIER_REMOVAL_WINDOW, sigma: float = OUTLIER_REMOVAL_SIGMA,
+                     column_types: list[str] = QC_COLUMN_TYPES, center: bool = True, min_periods: int = 1) -> tuple[pd.DataFrame, dict[str, int]]:
+    # Straightforward pandas rolling implementation of the same rule, for checking and benchmarking
+    df = df.copy()
+    elims = {}
+    for col in df.columns:
+        if col.split("_")[0] not in column_types:
+            continue
+        rolling = df[col].rolling(window = window_size_observations, center = center, min_periods = min_periods)
+        outliers = (df[col] - rolling.mean()).abs() > sigma * rolling.std()
+        df.loc[outliers, col] = np.nan
+        elims[col] = int(outliers.sum())
+    return df, elims
+
+
+def synthetic_frame(rows: int = ROWS_PER_FILE, booms: list[int] = BOOMS, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    data = {}
+    for var in QC_COLUMN_TYPES + ["w"]:
+        for b in booms:
+            x = np.cumsum(rng.normal(0, 0.01, rows)) + rng.normal(0, 1, rows)
+            spikes = rng.random(rows) < 1e-3
+            x[spikes] += rng.choice([-1, 1], spikes.sum()) * rng.uniform(10, 50, spikes.sum())
+            x[rng.random(rows) < 1e-3] = np.nan
+            data[f"{var}_{b}"] = x
+    return pd.DataFrame(data)
+
+
+def benchmark(repeats: int = 3, threads: int = 4) -> None:
+    df = synthetic_frame()
+    print(f"Synthetic file: {df.shape[0]} rows x {df.shape[1]} columns, window {OUTLIER_REMOVAL_WINDOW}, sigma {OUTLIER_REMOVAL_SIGMA}")
+
+    candidates = {
+        "pandas rolling" : lambda : pandas_reference(df),
+        "windprofiles" : lambda : process.rolling_outlier_removal(df = df, window_size_observations = OUTLIER_REMOVAL_WINDOW,
+                                                                  sigma = OUTLIER_REMOVAL_SIGMA, column_types = QC_COLUMN_TYPES,
+                                                                  remove_if_any = False),
+    }
+    engines = {"numpy" : False}
+    if numba is not None:
+        engines["numba"] = True
+        rolling_outlier_removal(df.iloc[:OUTLIER_REMOVAL_WINDOW], compiled = True) # compile (or load the cached kernel) outside the timings
+    for engine, compiled in engines.items():
+        candidates[f"{engine} (1 thread)"] = lambda compiled = compiled : rolling_outlier_removal(df, compiled = compiled)
+        candidates[f"{engine} ({threads} threads)"] = lambda compiled = compiled : rolling_outlier_removal(df, threads = threads, compiled = compiled)
+
+    timings = {}
+    outputs = {}
+    for name, run in candidates.items():
+        best = np.inf
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            outputs[name] = run()
+            best = min(best, time.perf_counter() - t0)
+        timings[name] = best
+
+    baseline = timings["pandas rolling"]
+    for name, t in timings.items():
+        print(f"{name:>20}: {t:8.3f} s per file ({baseline / t:5.1f}x)")
+
+    # windprofiles' implementation is the reference: compare the counts and exactly which values each candidate removes
+    reference, ref_elims = outputs["windprofiles"]
+    columns = [col for col in df.columns if col.split("_")[0] in QC_COLUMN_TYPES]
+    ref_removed = (df[columns].notna() & reference[columns].isna()).to_numpy()
+    for name, (out, elims) in outputs.items():
+        if name == "windprofiles":
+            continue
+        mismatched = {col : (ref_elims.get(col), elims.get(col)) for col in columns if ref_elims.get(col) != elims.get(col)}
+        differing = int(((df[columns].notna() & out[columns].isna()).to_numpy() != ref_removed).sum())
+        print(f"{name:>20}: {sum(elims.values())} removed ({sum(ref_elims.values())} by windprofiles), "
+              f"{len(mismatched)} columns with differing counts {mismatched if mismatched else ''}, {differing} values removed differently")
+
+
+if __name__ == "__main__":
+    benchmark()
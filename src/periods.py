@@ -0,0 +1,101 @@
+# ruff: noqa: F403, F405
+from definitions import *
+from fluxes import FLUX_VARIABLES, stack_booms, cross_moments, covariances
+from math import gcd
+from functools import reduce
+import pandas as pd
+import numpy as np
+
+
+def block_minutes(periods: list[int]) -> int:
+    # Length of the blocks that every averaging period, and the chunks a file is streamed in, are made of
+    return reduce(gcd, list(periods) + [CHUNK_TIME])
+
+
+def yaw_rotation(means: np.ndarray) -> np.ndarray:
+    # (... x variables x variables) rotations of u, v into the mean wind direction (mean v = 0), leaving other variables alone
+    u, v = FLUX_VARIABLES.index("u"), FLUX_VARIABLES.index("v")
+    theta = np.arctan2(means[..., v], means[..., u])
+    c, s = np.cos(theta), np.sin(theta)
+    R = np.broadcast_to(np.eye(len(FLUX_VARIABLES)), means.shape + (len(FLUX_VARIABLES),)).copy()
+    R[..., u, u], R[..., u, v] = c, s
+    R[..., v, u], R[..., v, v] = -s, c
+    return R
+
+
+class PeriodMoments:
+    # Pairwise-complete block sums of FLUX_VARIABLES for one file, accumulated chunk by chunk (in E, N coordinates),
+    # from which the means and covariances over any averaging period made of whole blocks follow without another pass
+    def __init__(self, booms: list[int], periods: list[int] = AVERAGING_PERIODS, fs: float = SAMPLING_FREQUENCY):
+        self.booms = booms
+        self.periods = sorted(periods)
+        self.block = block_minutes(self.periods)
+        self.block_rows = int(self.block * 60 * fs)
+        self.shift = None
+        self.sums = []
+        self.filled = [] # rows of each block that came from the frame rather than padding
+
+    def add(self, df: pd.DataFrame) -> None:
+        # Short frames (a short file or final chunk) are padded with NaN so that every block is exactly block_rows long
+        X = stack_booms(df, self.booms, FLUX_VARIABLES)
+        blocks = max(1, -(-len(X) // self.block_rows))
+        if (pad := blocks * self.block_rows - len(X)):
+            X = np.concatenate([X, np.full((pad,) + X.shape[1:], np.nan)])
+        n, s, p, self.shift = cross_moments(X, blocks, self.shift)
+        self.sums.append((n, s, p))
+        self.filled.extend(np.clip(len(df) - self.block_rows * np.arange(blocks), 0, self.block_rows))
+
+    def rows(self, start: pd.Timestamp) -> list[dict]:
+        # One row per averaging period in the file, keyed by (time, period) with period in minutes; periods running past
+        # the end of the file (last block only padding) are left out, and `samples` counts the rows a period got from the
+        # file, so that one cut short by a short file shows. As in the chunk summaries, means are in (E, N) coordinates
+        # while (co)variances are rotated into each period's own mean wind.
+        if not self.sums:
+            return []
+        n, s, p = (np.concatenate(sums) for sums in zip(*self.sums))
+        filled = np.array(self.filled)
+        samples = np.concatenate([[0], np.cumsum(filled)])
+        csum = [np.concatenate([np.zeros_like(x[:1]), np.cumsum(x, axis = 0)]) for x in (n, s, p)]
+        idx = {var : i for i, var in enumerate(FLUX_VARIABLES)}
+        K = len(FLUX_VARIABLES)
+        result = []
+        for period in self.periods:
+            g = period // self.block
+            starts = np.arange(0, len(n) - g + 1, g)
+            starts = starts[filled[starts + g - 1] > 0]
+            if len(starts) == 0:
+                continue
+            means, cov = covariances(*(c[starts + g] - c[starts] for c in csum), self.shift) # (periods x booms x ...)
+            R = yaw_rotation(means)
+            cov = R @ cov @ R.swapaxes(-1, -2)
+            for i, first in enumerate(starts):
+                row = {"time" : start + pd.Timedelta(int(first) * self.block, "min"), "period" : period, "samples" : int(samples[first + g] - samples[first])}
+                for k, b in enumerate(self.booms):
+                    for a in range(K):
+                        var = FLUX_VARIABLES[a]
+                        row[f"{var}_{b}_mean"] = means[i, k, a]
+                        row[f"{var}_{b}_var"] = cov[i, k, a, a]
+                        for c in range(a + 1, K):
+                            row[f"{var}'{FLUX_VARIABLES[c]}'_{b}_mean"] = cov[i, k, a, c]
+                    row[f"tke_{b}"] = sum(cov[i, k, idx[var], idx[var]] for var in ["u", "v", "w"])
+                result.append(row)
+        return result
+
+
+def attach(summaries: list[dict], rows: list[dict]) -> list[dict]:
+    # Hands each period row to the summary of the chunk its period starts in, as the "periods" side output
+    for summary in summaries:
+        summary["periods"] = []
+    if summaries:
+        start = summaries[0]["time"]
+        for row in rows:
+            i = min(int((row["time"] - start) / pd.Timedelta(CHUNK_TIME, "min")), len(summaries) - 1)
+            summaries[i]["periods"].append(row)
+    return summaries
+
+
+def frame(rows: list[dict]) -> pd.DataFrame:
+    # Tidy table indexed by (time, period)
+    if not rows:
+        return pd.DataFrame(index = pd.MultiIndex.from_arrays([[], []], names = ["time", "period"]))
+    return pd.DataFrame(rows).set_index(["time", "period"]).sort_index()
@@ -0,0 +1,70 @@
+# ruff: noqa: F403, F405
+from definitions import *
+from config import parse, results_dir
+import store
+import pandas as pd
+import numpy as np
+
+MIN_FIT_BOOMS = 4 # fewest booms with valid speeds for which a power law is fit
+RICHARDSON_PAIRS = [(5, 6)] # boom pairs (lower, upper) for bulk Richardson numbers; 16.8 and 47.3 m
+BULK_RICHARDSON_PAIR = (5, 6) # the pair whose number is named ri_bulk, as in old/ttu.py
+
+
+def power_law_alpha(df: pd.DataFrame, booms: list[int] = BOOMS, heights: dict[int, float] = HEIGHTS_DICT, min_booms: int = MIN_FIT_BOOMS) -> pd.Series:
+    # Shear exponent of ws = A z^alpha for every row at once, as the least-squares slope in log-log space
+    # over the booms whose mean speed is valid in that row
+    ws = df[[f"ws_{b}_mean" for b in booms]].to_numpy(dtype = np.float64)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        y = np.log(ws)
+    m = np.isfinite(y).astype(np.float64) # (rows x booms)
+    y = np.where(m > 0, y, 0.)
+    x = np.log(np.array([heights[b] for b in booms]))
+
+    n = m.sum(axis = 1)
+    sx, sy = m @ x, y.sum(axis = 1)
+    sxx, sxy = m @ x**2, y @ x
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        alpha = (n * sxy - sx * sy) / (n * sxx - sx**2)
+    return pd.Series(np.where(n >= min_booms, alpha, np.nan), index = df.index, name = "alpha")
+
+
+def richardson_name(pair: tuple[int, int]) -> str:
+    return "ri_bulk" if tuple(pair) == BULK_RICHARDSON_PAIR else f"ri_{pair[0]}_{pair[1]}"
+
+
+def bulk_richardson(df: pd.DataFrame, pairs: list[tuple[int, int]] = RICHARDSON_PAIRS, heights: dict[int, float] = HEIGHTS_DICT, gravity: float = LOCATION.g) -> pd.DataFrame:
+    # Bulk Richardson number (g / vpt) dvpt dz / (du^2 + dv^2) for each boom pair, for every row at once. The wind
+    # components are the unaligned chunk means, which share one coordinate frame across booms.
+    lower, upper = zip(*pairs)
+    def block(var, booms):
+        return df[[f"{var}_{b}_mean" for b in booms]].to_numpy(dtype = np.float64) # (rows x pairs)
+    vpt_lo, vpt_hi = block("vpt", lower), block("vpt", upper)
+    shear = (block("u", upper) - block("u", lower))**2 + (block("v", upper) - block("v", lower))**2
+    dz = np.array([heights[hi] - heights[lo] for lo, hi in pairs])
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        ri = gravity / (0.5 * (vpt_lo + vpt_hi)) * (vpt_hi - vpt_lo) * dz / shear
+    ri[~np.isfinite(ri)] = np.nan
+    return pd.DataFrame(ri, index = df.index, columns = [richardson_name(pair) for pair in pairs])
+
+
+def profile_stats(df: pd.DataFrame, booms: list[int] = BOOMS, pairs: list[tuple[int, int]] = RICHARDSON_PAIRS) -> pd.DataFrame:
+    return pd.concat([power_law_alpha(df, booms), bulk_richardson(df, pairs)], axis = 1)
+
+
+def profiles_path(selection: str, test: bool = False) -> str:
+    return os.path.join(results_dir, "testing" if test else "analysis", f"{selection}_profiles.parquet")
+
+
+def main():
+    args = parse("postprocess")
+    selection = args["selection"]
+    columns = [f"{var}_{b}_mean" for var in ["ws", "u", "v", "vpt"] for b in BOOMS]
+    df = store.load(selection, store.store_dir(args["test"]), columns = columns)
+    res = profile_stats(df)
+    saveto = profiles_path(selection, args["test"])
+    res.reset_index(names = "time").to_parquet(saveto, index = False)
+    print(f"Saved power law exponents and bulk Richardson numbers for {len(res)} rows to {saveto}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,102 +3,134 @@ from definitions import *
 from config import parse, parent_dir, results_dir
 import windprofiles.process as process
 import windprofiles.process.sonic as sonic
-import windprofiles.lib.stats as stats
-import windprofiles.lib.atmos as atmos
 from windprofiles.user.logs import get_main_logger
+from ledger import Ledger, Quarantine, code_fingerprint
+from catalog import Catalog, get_datetime_from_filename
+from logging.handlers import QueueHandler, QueueListener
+import pyarrow.csv as pv
+import pyarrow as pa
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import multiprocessing
+import threading
+import queue
+import errno
+import time
+import instrument
+import autocorr
+import derived
+import fluxes
+import periods
+import stationarity
+import spectra
+import store
+import cache
+import archive
+import outliers
 import logging
 import pandas as pd
 import numpy as np
-import warnings
 import os
-warnings.filterwarnings("ignore", message = "DataFrame is highly fragmented")
 
 
-import matplotlib.pyplot as plt
+def source_columns(variables: list[str] = None, booms: list[int] = None) -> dict[str, str]:
+    # Source headers that survive formatting (optionally restricted to some variables/booms), with their formatted names
+    columns = {}
+    for head in SOURCE_HEADERS:
+        source_type, boom_number = head.split("_")
+        var, boom = HEADER_MAP[source_type], int(boom_number)
+        if var is None or boom in DROP_BOOMS:
+            continue
+        if (variables is not None and var not in variables) or (booms is not None and boom not in booms):
+            continue
+        columns[head] = f"{var}_{boom}"
+    return columns
 
 
-def get_datetime_from_filename(filepath: os.PathLike) -> pd.Timestamp:
-    filename = os.path.basename(filepath).split(".")[0]
-    DATE_STR = filename.split("_")[4]
-    YEAR = int(DATE_STR[1:5])
-    MONTH = int(DATE_STR[5:7])
-    DAY = int(DATE_STR[7:9])
-    TIME_STR = filename.split("_")[5]
-    HOUR = int(TIME_STR[1:3])
-    MIN = int(TIME_STR[3:5])
-    START_TIME = pd.Timestamp(year = YEAR, month = MONTH, day = DAY, hour = HOUR, minute = MIN, tz = "UTC")
-    return START_TIME
+def csv_options(columns: dict[str, str], block_size: int = None) -> dict:
+    # Only the surviving columns are parsed; everything else is skipped by the pyarrow reader
+    dtype = pa.type_for_alias(SOURCE_DTYPE)
+    read_options = pv.ReadOptions(column_names = SOURCE_HEADERS)
+    if block_size is not None:
+        read_options.block_size = block_size
+    return {
+        "read_options" : read_options,
+        "convert_options" : pv.ConvertOptions(include_columns = list(columns), column_types = {head : dtype for head in columns})
+    }
 
 
-def load_and_format_file(filepath: os.PathLike) -> tuple[pd.DataFrame, list[int]]:
-    df = pd.read_csv(filepath, compression = "gzip", header = None, engine = "pyarrow")
-    df.rename(columns = {i : SOURCE_HEADERS[i] for i in range(120)}, inplace = True)
-    df.drop(columns = [head for head in SOURCE_HEADERS if int(head.split("_")[1]) in DROP_BOOMS], inplace = True)
+def raw_stream(filepath: os.PathLike, data: bytes = None):
+    # Decompressing stream over a raw file, or over its bytes if they have already been read
+    return pa.input_stream(filepath if data is None else pa.py_buffer(data), compression = "gzip")
 
-    df = process.rename_headers(df, HEADER_MAP, True, True)
 
+def load_and_format_file(filepath: os.PathLike, variables: list[str] = None, booms: list[int] = None, data: bytes = None) -> tuple[pd.DataFrame, list[int]]:
+    columns = source_columns(variables, booms)
+    table = pv.read_csv(raw_stream(filepath, data), **csv_options(columns))
+    df = table.to_pandas().rename(columns = columns)
+
+    return df, booms_from_columns(df.columns)
+
+
+def iter_formatted_batches(filepath: os.PathLike, block_size: int = 1 << 22, data: bytes = None):
+    # Formatted frames of a few thousand rows each, decompressed and parsed incrementally
+    columns = source_columns()
+    reader = pv.open_csv(raw_stream(filepath, data), **csv_options(columns, block_size))
+    for batch in reader:
+        yield batch.to_pandas().rename(columns = columns)
+
+
+def booms_from_columns(columns) -> list[int]:
     boomset = set()
-    for col in df.columns:
+    for col in columns:
         col_type, boom_number = col.split("_")
         boomset.add(int(boom_number))
     booms_list = list(boomset)
     booms_list.sort()
+    return booms_list
+
+
+def boom_block(df: pd.DataFrame, variable: str, booms: list[int]) -> np.ndarray:
+    return df[[f"{variable}_{b}" for b in booms]].to_numpy(dtype = np.float64)
+
+
+MEAN_VARIABLES = ["u", "v", "es", "e", "r", "q", "vt", "pt", "vpt", "ts", "t"]
 
-    return df, booms_list
 
+def prepare_chunk(df: pd.DataFrame, booms: list[int]) -> pd.DataFrame:
+    # Winds in (E, N) coordinates, plus just the derived variables that the summary stages use, for all booms at once
+    needed = list(dict.fromkeys(["u", "v"] + MEAN_VARIABLES + fluxes.FLUX_VARIABLES + autocorr.SCALE_VARIABLES))
+    return derived.attach(df, booms, [var for var in needed if var in ["u", "v"] or derived.is_derived(var)], derived.east_north(df, booms))
 
-def filtery(s):
-    si = np.arange(len(s))
-    mask = np.isfinite(s)
-    return np.interp(si, si[mask], s[mask])
 
-def summarize_df(df: pd.DataFrame, booms_available: list[int], timestamp: pd.Timestamp) -> dict:
+def summarize_df(df: pd.DataFrame, booms_available: list[int], timestamp: pd.Timestamp, prepared: bool = False) -> dict:
+    # `prepared` means prepare_chunk has already been applied to df
     logger = logging.getLogger("summarize_df")
 
     result = {"time" : timestamp}
 
-    for b in booms_available:
-        df[f"u_{b}"], df[f"v_{b}"] = df[f"v_{b}"], -df[f"u_{b}"] # convert from (N, W) coordinates to (E, N) coordinates
-        df[f"es_{b}"] = atmos.saturation_vapor_pressure(df[f"t_{b}"]) # saturation vapor pressure
-        df[f"e_{b}"] = atmos.water_partial_pressure(df[f"rh_{b}"], df[f"es_{b}"]) # partial pressure of water
-        df[f"r_{b}"] = atmos.water_air_mixing_ratio(df[f"e_{b}"], df[f"p_{b}"]) # water-air mixing ratio
-        df[f"q_{b}"] = atmos.specific_humidity(df[f"r_{b}"]) # specific humidity
-        df[f"vt_{b}"] = atmos.virtual_temperature(df[f"t_{b}"], df[f"r_{b}"]) # virtual temperature
-        df[f"pt_{b}"] = atmos.potential_temperature(df[f"t_{b}"], df[f"p_{b}"]) # potential temperature
-        df[f"vpt_{b}"] = atmos.virtual_potential_temperature(df[f"pt_{b}"], df[f"r_{b}"]) # virtual potential temperature
-    
-    result |= sonic.get_stats(df, np.mean, "_mean", ["u", "es", "e", "r", "q", "vt", "pt", "vpt", "ts", "t"])
-
-    result |= (mean_directions := sonic.mean_directions(df, booms_available)) # get mean directions for alignment
-    df = sonic.align_to_directions(df, mean_directions) # streamwise alignment
-
-    for b in [9]:
-        x = df[f"u_{b}"]
-        xi = np.arange(len(x))
-        mask = np.isfinite(x)
-        xfiltered = np.interp(xi, xi[mask], x[mask])
-        fft = np.fft.rfft(xfiltered)
-        power_spectrum = np.abs(fft)**2
-        frequencies = np.fft.rfftfreq(len(df), 1/50)
-        fig, axs = plt.subplots()
-        # axs[0].plot(frequencies, power_spectrum)
-        # axs[0].set_xscale("log")
-        # axs[0].set_yscale("log")
-        # axs[1].plot(xi, x)
-        axs = [0,0,axs]
-        axs[2].plot(xi, df[f"pt_{b}"], label="potential")
-        axs[2].plot(xi, df[f"vt_{b}"], label="virtual")
-        axs[2].plot(xi, df[f"vpt_{b}"], label="virtual potential")
-        axs[2].plot(xi, df[f"ts_{b}"], label="sonic")
-        axs[2].plot(xi, df[f"t_{b}"], label="air")
-        axs[2].legend()
-
-        print(np.corrcoef(filtery(df[f"vt_{b}"]), filtery(df[f"ts_{be}"]))[0,1])
-
-        fig.tight_layout()
-        plt.show()
+    with instrument.stage("derived"):
+        df = df.copy() if prepared else prepare_chunk(df, booms_available)
+
+    with instrument.stage("means"):
+        result |= sonic.get_stats(df, np.mean, "_mean", MEAN_VARIABLES)
+
+    with instrument.stage("alignment"):
+        result |= (mean_directions := sonic.mean_directions(df, booms_available)) # get mean directions for alignment
+        df = sonic.align_to_directions(df, mean_directions) # streamwise alignment
+
+    with instrument.stage("fluxes"):
+        moments = fluxes.block_moments(df, booms_available, STATIONARITY_SUBINTERVALS)
+        result |= fluxes.flux_stats(df, booms_available, timestamp = timestamp, moments = moments)
+
+    with instrument.stage("stationarity"):
+        result |= stationarity.stationarity_stats(moments, booms_available)
 
+    with instrument.stage("integral_scales"):
+        result |= autocorr.integral_scales(df, booms_available)
 
+    with instrument.stage("spectra"):
+        result["spectra"] = spectra.chunk_spectra(df, booms_available) # side output, split off from the summary table
 
     return result
 
@@ -170,62 +202,434 @@ def summarize_df(df: pd.DataFrame, booms_available: list[int], timestamp: pd.Tim
 #     return result
 
 
-def qc_step(df, filepath):
-    logger = logging.getLogger("qc")
+def qc_frame(df: pd.DataFrame) -> tuple[pd.DataFrame, dict]:
     # Rolling outlier removal
-    df, elims = process.rolling_outlier_removal(df = df,
+    return outliers.rolling_outlier_removal(df = df,
                                             window_size_observations = OUTLIER_REMOVAL_WINDOW,
                                             sigma = OUTLIER_REMOVAL_SIGMA,
-                                            column_types = ["u", "v", "t", "ts", "p", "rh"],
-                                            remove_if_any = False)
+                                            column_types = outliers.QC_COLUMN_TYPES)
 
+
+def warn_eliminations(elims: dict, filepath: os.PathLike) -> None:
+    logger = logging.getLogger("qc")
     for key, val in elims.items():
         if val > ROWS_PER_FILE*0.02:
             logger.warning(f"For {filepath}, more than 2% ({val}) of {key} removed as spikes")
 
+
+def qc_step(df, filepath):
+    df, elims = qc_frame(df)
+    warn_eliminations(elims, filepath)
     return df
 
 
-def process_file(filepath: os.PathLike, qc: bool = True) -> list[dict]:
-    df, booms_available = load_and_format_file(filepath)
+def process_file(filepath: os.PathLike, qc: bool = True, use_cache: bool = USE_CACHE, variables: list[str] = None, booms: list[int] = None, use_archive: bool = USE_ARCHIVE, data: bytes = None) -> list[dict]:
+    # `data` is the raw file's (compressed) contents, if they have already been read
+    subset = variables is not None or booms is not None
+    if use_archive and (archived := archive.find(filepath)) is not None:
+        with instrument.stage("archive_load"):
+            df = archived.file_frame(filepath, qc, list(source_columns(variables, booms).values()) if subset else None)
+        if df is not None:
+            if qc and not subset:
+                warn_eliminations(archived.eliminations(filepath), filepath)
+            return df, booms_from_columns(df.columns)
+
+    if use_cache:
+        with instrument.stage("cache_load"):
+            df = cache.load(filepath, qc, list(source_columns(variables, booms).values()) if subset else None)
+        if df is not None:
+            if qc and not subset:
+                warn_eliminations(cache.eliminations(filepath, qc) or {}, filepath)
+            return df, booms_from_columns(df.columns)
+
+    with instrument.stage("read"):
+        df, booms_available = load_and_format_file(filepath, variables, booms, data)
 
     # Unit conversion
-    df = process.convert_dataframe_units(df, from_units = SOURCE_UNITS, gravity = LOCATION.g)
+    with instrument.stage("convert"):
+        df = process.convert_dataframe_units(df, from_units = SOURCE_UNITS, gravity = LOCATION.g)
     
     # QC step
+    elims = None
     if qc:
-        df = qc_step(df, filepath)
+        with instrument.stage("qc"):
+            df, elims = qc_frame(df)
+        warn_eliminations(elims, filepath)
+
+    if use_cache and not subset: # only complete frames are cached, with their elimination counts
+        with instrument.stage("cache_store"):
+            cache.store(df, filepath, qc, elims)
 
     return df, booms_available
 
 
-def summarize_file(filepath: os.PathLike) -> list[dict]:
-    df, booms_available = process_file(filepath)
+def stream_file(filepath: os.PathLike, qc: bool = True, use_cache: bool = USE_CACHE, data: bytes = None):
+    # Yields converted (and QC'd) CHUNK_SIZE-row frames without ever holding the whole file. QC of
+    # each chunk sees OUTLIER_REMOVAL_WINDOW rows of context on either side, so results match process_file.
+    if use_cache and (batches := cache.iter_chunks(filepath, qc)) is not None:
+        if qc:
+            warn_eliminations(cache.eliminations(filepath, qc) or {}, filepath)
+        yield from batches
+        return
+
+    context = OUTLIER_REMOVAL_WINDOW if qc else 0
+    buffer = [] # converted frames, starting at absolute row `offset`
+    offset = 0
+    available = 0 # absolute row index up to which data has been read
+    chunk = 0
+    elims = {}
+
+    def emit() -> pd.DataFrame:
+        nonlocal buffer, offset
+        start = chunk * CHUNK_SIZE
+        end = min(start + CHUNK_SIZE, available)
+        frame = pd.concat(buffer, ignore_index = True) if len(buffer) > 1 else buffer[0]
+        lo = max(start - context, offset)
+        window = frame.iloc[lo - offset:min(end + context, available) - offset]
+        middle = slice(start - lo, end - lo)
+        if qc:
+            with instrument.stage("qc"):
+                before = window.iloc[middle].notna().sum()
+                window, _ = qc_frame(window)
+                for col, val in (before - window.iloc[middle].notna().sum()).items(): # count only the rows this chunk owns
+                    elims[col] = elims.get(col, 0) + int(val)
+        out = window.iloc[middle].reset_index(drop = True)
+        keep_from = max(end - context, offset)
+        buffer = [frame.iloc[keep_from - offset:].reset_index(drop = True)]
+        offset = keep_from
+        return out
+
+    for batch in iter_formatted_batches(filepath, data = data):
+        with instrument.stage("convert"):
+            buffer.append(process.convert_dataframe_units(batch, from_units = SOURCE_UNITS, gravity = LOCATION.g))
+        available += len(batch)
+        while available >= (chunk + 1) * CHUNK_SIZE + context: # enough lookahead to finalize this chunk
+            yield emit()
+            chunk += 1
+    while chunk * CHUNK_SIZE < available:
+        yield emit()
+        chunk += 1
 
-    TIMESTAMP = get_datetime_from_filename(filepath).tz_convert(LOCATION.timezone)
+    if qc:
+        warn_eliminations(elims, filepath)
 
-    split = [df.iloc[CHUNK_SIZE*i:CHUNK_SIZE*(i+1)] for i in range(SPLIT_INTO_CHUNKS)]
 
-    result = [summarize_df(d, booms_available, TIMESTAMP + i * pd.Timedelta(CHUNK_TIME, "min")) for i, d in enumerate(split)]
+def summarize_chunk(df: pd.DataFrame, booms_available: list[int], timestamp: pd.Timestamp, prepared: bool = False) -> dict:
+    with instrument.stage("summarize_df"):
+        return summarize_df(df, booms_available, timestamp, prepared)
+
+
+def summarize_file(filepath: os.PathLike, stream: bool = STREAM_FILES, use_cache: bool = USE_CACHE, averaging_periods: list[int] = AVERAGING_PERIODS, data: bytes = None) -> list[dict]:
+    # Chunk summaries of a file. With `averaging_periods` (minutes), each summary also carries a "periods" side output:
+    # moments over every listed period starting in that chunk, all from one set of block sums (see periods.py).
+    TIMESTAMP = get_datetime_from_filename(filepath).tz_convert(LOCATION.timezone)
+
+    if stream:
+        result = []
+        moments = None
+        for i, d in enumerate(stream_file(filepath, use_cache = use_cache, data = data)):
+            booms_available = booms_from_columns(d.columns)
+            with instrument.stage("derived"):
+                d = prepare_chunk(d, booms_available)
+            if averaging_periods:
+                moments = moments or periods.PeriodMoments(booms_available, averaging_periods)
+                with instrument.stage("period_moments"):
+                    moments.add(d)
+            result.append(summarize_chunk(d, booms_available, TIMESTAMP + i * pd.Timedelta(CHUNK_TIME, "min"), prepared = True))
+    else:
+        df, booms_available = process_file(filepath, use_cache = use_cache, data = data)
+        with instrument.stage("derived"):
+            df = prepare_chunk(df, booms_available)
+        if averaging_periods:
+            moments = periods.PeriodMoments(booms_available, averaging_periods)
+            with instrument.stage("period_moments"):
+                moments.add(df)
+
+        split = [df.iloc[CHUNK_SIZE*i:CHUNK_SIZE*(i+1)] for i in range(SPLIT_INTO_CHUNKS)]
+
+        result = [summarize_chunk(d, booms_available, TIMESTAMP + i * pd.Timedelta(CHUNK_TIME, "min"), prepared = True) for i, d in enumerate(split)]
+
+    if averaging_periods and moments is not None:
+        with instrument.stage("period_moments"):
+            periods.attach(result, moments.rows(TIMESTAMP))
 
     return result
 
 
-def process_day_directory(dirpath: os.PathLike, nproc: int, test: bool, logfile: os.PathLike) -> pd.DataFrame:
-    df = sonic.analyze_directory(
-        path=dirpath,
-        analysis=summarize_file,
-        logfile=logfile,
-        nproc=nproc,
-        limit=max(1,nproc-1) if test else None,
-        index="time",
-        progress=True
-    )
-    df.reset_index(names="time", inplace=True)
-    df["time"] = pd.to_datetime(df["time"])
-    df.set_index("time", inplace=True)
-    df.sort_index(ascending=True, inplace=True)
-    return df
+_profile_dir = None # set in pool workers when --profile is given
+_started = None # queue on which pool workers announce the files they start, with the generation of their pool
+_generation = 0
+
+
+def init_worker(log_queue, profile_dir: os.PathLike = None, started = None, generation: int = 0) -> None:
+    # Route worker logging through the main process's handlers
+    global _profile_dir, _started, _generation
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(log_queue)]
+    root.setLevel(logging.INFO)
+    _profile_dir = profile_dir
+    _started, _generation = started, generation
+
+
+TRANSIENT_ERRNOS = {errno.EIO, errno.EAGAIN, errno.EBUSY, errno.ETIMEDOUT, errno.ESTALE, errno.ECONNRESET, errno.ECONNABORTED, errno.ENETDOWN, errno.ENETUNREACH, errno.EHOSTUNREACH}
+
+
+def is_transient(e: Exception) -> bool:
+    # I/O failures that may not happen again (network shares, busy disks), as opposed to bad data
+    return isinstance(e, (TimeoutError, ConnectionError, InterruptedError)) or (isinstance(e, OSError) and e.errno in TRANSIENT_ERRNOS)
+
+
+def summarize_task(task: tuple[str, os.PathLike, bytes | None]) -> tuple[str, os.PathLike, list[dict] | None, list[dict], str | None, bool]:
+    # Returns the summary rows (None on failure) along with per-stage timing records for the file,
+    # and on failure the error and whether it is worth retrying
+    campaign, filepath, data = task
+    if _started is not None:
+        _started.put((_generation, (campaign, filepath)))
+    profile_to = None if _profile_dir is None else os.path.join(_profile_dir, f"{os.getpid()}_{os.path.basename(filepath)}.prof")
+    error, transient = None, False
+    with instrument.recording(TRACE_ALLOCATIONS, profile_to) as recorder:
+        try:
+            with instrument.stage("file"):
+                rows = summarize_file(filepath, data = data)
+        except Exception as e: # one bad file should not bring down the whole queue
+            logging.getLogger("summarize_task").exception(f"Failed to summarize {filepath}: {e}")
+            rows, error, transient = None, f"{type(e).__name__}: {e}", is_transient(e)
+    for record in recorder.records:
+        record["file"] = filepath
+    return campaign, filepath, rows, recorder.records, error, transient
+
+
+def read_raw(filepath: os.PathLike) -> bytes | None:
+    # Compressed contents of a raw file for a worker to decode, or None if the worker will not need them
+    # (served from the archive or cache) or they could not be read here (the worker then retries and reports it)
+    if USE_ARCHIVE and (archived := archive.find(filepath)) is not None and archived.holds(filepath):
+        return None
+    if USE_CACHE and os.path.exists(cache.cache_path(filepath, True)):
+        return None
+    try:
+        with open(filepath, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def parse_time(time: str | None) -> pd.Timestamp | None:
+    if time is None:
+        return None
+    time = pd.Timestamp(time)
+    return time.tz_localize(LOCATION.timezone) if time.tz is None else time
+
+
+def list_campaign_files(dirs: dict[str, str], datapath: os.PathLike, test: bool, limit: int, start: pd.Timestamp = None, end: pd.Timestamp = None) -> dict[str, list[str]]:
+    # Every raw file in [start, end) for each [process] key
+    files = {}
+    for k, v in dirs.items():
+        files[k] = Catalog(k, os.path.join(datapath, v)).between(start, end)
+        if test:
+            files[k] = files[k][:limit]
+            break
+    return files
+
+
+def schedule(tasks: list[tuple[str, os.PathLike]]) -> list[tuple[str, os.PathLike]]:
+    # Largest files first, so that the long tail of the queue is made of short tasks. Files that vanished since they
+    # were listed sort last, and their workers report them as failed.
+    def size(task):
+        try:
+            return os.path.getsize(task[1])
+        except OSError:
+            return 0
+    return sorted(tasks, key = size, reverse = True)
+
+
+def process_files(tasks: list[tuple[str, os.PathLike]], nproc: int, log_queue, profile_dir: os.PathLike = None, timeout: float = FILE_TIMEOUT, retries: int = FILE_RETRIES):
+    # Yields (campaign, filepath, rows, stage records, error) for each file once it has been summarized, or has finally
+    # failed (rows None, error a message), from one pool shared by all campaigns.
+    # Reader threads fetch raw files ahead of the workers, so compute overlaps I/O on slow storage; at most PREFETCH_FILES
+    # files are held waiting for a worker, and each worker has one more file queued behind the one it is running. A file
+    # still running `timeout` seconds after a worker started it gets the pool terminated and rebuilt (the other files
+    # in flight are resubmitted), and timeouts and transient I/O errors are retried up to `retries` times.
+    if not tasks:
+        return
+    logger = logging.getLogger("process_files")
+    workers = max(1, nproc - 1)
+    pending = deque(schedule(tasks))
+    events = queue.Queue() # ("read", task, data) from readers, ("started", generation, task) and ("done", generation, result) from workers
+    started = multiprocessing.Queue()
+    ready = deque() # read, waiting for a worker
+    running = {} # task -> (data, deadline), for tasks handed to the current pool; deadline None until a worker starts it
+    attempts = {} # task -> failed attempts so far
+    reading = 0
+    generation = 0 # bumped whenever the pool is replaced, so that late results from the old one are ignored
+
+    def read(task):
+        try:
+            data = read_raw(task[1])
+        except Exception: # must always report back, or the loop below would wait forever; the worker reads the file itself
+            data = None
+        events.put(("read", task, data))
+
+    def forward_starts():
+        while (item := started.get()) is not None:
+            events.put(("started", *item))
+
+    def new_pool():
+        return multiprocessing.Pool(workers, initializer=init_worker, initargs=(log_queue, profile_dir, started, generation))
+
+    def dispatch(task, data):
+        g = generation
+        pool.apply_async(summarize_task, ((*task, data),),
+                         callback=lambda result : events.put(("done", g, result)),
+                         error_callback=lambda e : events.put(("done", g, (*task, None, [], f"{type(e).__name__}: {e}", False))))
+        running[task] = (data, None)
+
+    def retry(task, error, transient) -> bool:
+        if not transient or attempts.get(task, 0) >= retries:
+            return False
+        attempts[task] = attempts.get(task, 0) + 1
+        logger.warning(f"Retrying {task[1]} (attempt {attempts[task] + 1} of {retries + 1}) after: {error}")
+        pending.append(task)
+        return True
+
+    pool = new_pool()
+    forwarder = threading.Thread(target=forward_starts, daemon=True)
+    forwarder.start()
+    try:
+        with ThreadPoolExecutor(READER_THREADS) as readers:
+            while pending or reading or ready or running:
+                while pending and reading + len(ready) < PREFETCH_FILES:
+                    readers.submit(read, pending.popleft())
+                    reading += 1
+                while ready and len(running) < 2 * workers:
+                    dispatch(*ready.popleft())
+
+                deadlines = [deadline for _, deadline in running.values() if deadline is not None]
+                wait = max(0., min(deadlines) - time.monotonic()) if deadlines else None
+                try:
+                    event = events.get(timeout=wait)
+                except queue.Empty: # at least one file has hung
+                    now = time.monotonic()
+                    expired = [task for task, (_, deadline) in running.items() if deadline is not None and deadline <= now]
+                    pool.terminate()
+                    pool.join()
+                    generation += 1
+                    for task, (data, _) in running.items():
+                        if task not in expired:
+                            ready.appendleft((task, data))
+                    running.clear()
+                    pool = new_pool()
+                    for task in expired:
+                        error = f"Timed out after {timeout} s"
+                        logger.warning(f"{task[1]}: {error}; restarted the worker pool")
+                        if not retry(task, error, True):
+                            yield (*task, None, [], error)
+                    continue
+
+                if event[0] == "read":
+                    reading -= 1
+                    ready.append((event[1], event[2]))
+                    continue
+                if event[0] == "started":
+                    _, g, task = event
+                    if g == generation and task in running and running[task][1] is None:
+                        running[task] = (running[task][0], time.monotonic() + timeout)
+                    continue
+                _, g, (campaign, filepath, rows, records, error, transient) = event
+                if g != generation: # from a pool that has since been replaced; the file was resubmitted
+                    continue
+                task = (campaign, filepath)
+                running.pop(task, None)
+                if rows is None and retry(task, error, transient):
+                    continue
+                yield campaign, filepath, rows, records, error
+    finally:
+        pool.terminate()
+        pool.join()
+        started.put(None)
+        forwarder.join()
+
+
+def failure_summary(failures: list[tuple[str, os.PathLike, str]], skipped: int) -> str:
+    lines = [f"{len(failures)} file{'' if len(failures) == 1 else 's'} failed and were quarantined; {skipped} previously quarantined file{'' if skipped == 1 else 's'} skipped"]
+    for k, filepath, error in failures:
+        lines.append(f"  [{k}] {filepath}: {error}")
+    return "\n".join(lines)
+
+
+def settled(filepath: os.PathLike, age: float = FOLLOW_SETTLE) -> bool:
+    # Whether a raw file has gone unmodified for `age` seconds, i.e. is not still being written (False if it is gone)
+    try:
+        return time.time() - os.path.getmtime(filepath) > age
+    except OSError:
+        return False
+
+
+def follow(catalogs: dict[str, Catalog], files: dict[str, list[str]], ledger: Ledger, quarantine: Quarantine, fingerprint: str, nproc: int, log_queue, test: bool, start: pd.Timestamp = None, interval: float = FOLLOW_INTERVAL) -> list[tuple[str, os.PathLike, str]]:
+    # Polls the campaigns' data directories, summarizing raw files as they are completed and appending their rows to the
+    # results store. A file counts as completed once its size and mtime are unchanged over a poll and it has settled.
+    # Files whose ledger entry no longer matches them (they changed after being summarized) are summarized again.
+    # New files are added to `files`. Runs until interrupted (Ctrl+C), then returns the files that failed.
+    logger = logging.getLogger("follow")
+    known = {k : set(paths) for k, paths in files.items()}
+    since = {k : max((get_datetime_from_filename(f) for f in paths), default=start) for k, paths in files.items()} # from the latest file already processed on
+    seen = {} # (size, mtime) of each pending file at the last poll
+    failures = []
+    logger.info(f"Following {', '.join(catalogs)} for new files every {interval} s (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(interval)
+            tasks = []
+            for k, catalog in catalogs.items():
+                catalog.refresh()
+                for filepath in catalog.between(since[k]):
+                    if ledger.is_done(k, filepath, fingerprint) or quarantine.holds(filepath):
+                        continue
+                    try:
+                        stat = os.stat(filepath)
+                    except OSError: # removed since the catalog was refreshed
+                        continue
+                    if seen.get(filepath) != (state := (stat.st_size, stat.st_mtime_ns)) or not settled(filepath, FOLLOW_SETTLE):
+                        seen[filepath] = state
+                        continue
+                    tasks.append((k, filepath))
+
+            new = {}
+            for k, filepath, rows, _, error in process_files(tasks, nproc, log_queue):
+                seen.pop(filepath, None)
+                if filepath not in known[k]:
+                    known[k].add(filepath)
+                    files[k].append(filepath)
+                if rows is None:
+                    quarantine.add(k, filepath, error)
+                    failures.append((k, filepath, error))
+                else:
+                    ledger.record(k, filepath, fingerprint, rows)
+                    new.setdefault(k, []).append(filepath)
+            for k, paths in new.items():
+                store.append(ledger.frame(k, paths, exclude=SIDE_OUTPUTS), k, store.store_dir(test))
+                logger.info(f"Appended {len(paths)} new file{'s' if len(paths) > 1 else ''} of {k} to the results store")
+    except KeyboardInterrupt:
+        logger.info("Stopped following")
+    return failures
+
+
+def write_outputs(ledger: Ledger, files: dict[str, list[str]], outdir: os.PathLike, test: bool, csv: bool, whole: bool = True) -> None:
+    # Only a run over a whole campaign replaces its store; ranged or test runs update just the rows they processed.
+    # Campaign-level files (spectra, periods, CSVs) come from the run's files on a whole run, else from every row in the ledger.
+    for k, paths in files.items():
+        with instrument.stage("write_output"):
+            scope = paths if whole else None
+            res = ledger.frame(k, scope, exclude=SIDE_OUTPUTS)
+            spectra.save(os.path.join(outdir, f"{k}_spectra.npz"), *ledger.side_output(k, "spectra", scope))
+            by_period = periods.frame([row for rows in ledger.side_output(k, "periods", scope)[1] for row in rows])
+            by_period.reset_index().to_parquet(os.path.join(outdir, f"{k}_periods.parquet"), index=False)
+            if whole:
+                store.write(res, k, store.store_dir(test))
+            else:
+                store.append(ledger.frame(k, paths, exclude=SIDE_OUTPUTS), k, store.store_dir(test))
+            if csv:
+                res.to_csv(os.path.join(outdir, f"{k}.csv"), float_format="%g")
+                by_period.to_csv(os.path.join(outdir, f"{k}_periods.csv"), float_format="%g")
 
 
 def main():
@@ -244,28 +648,86 @@ def main():
         if o not in dirs:
             raise KeyError(f"{o} not in process keys")
         dirs = {o : dirs.get(o)}
-    
-    for k, v in dirs.items():
-        logger.info(f"On pair ({k},{v})")
-        dirpath = os.path.join(args["data"], v)
-        days = os.listdir(dirpath)
-        dfs = []
-        for d in days:
-            day_dir = os.path.join(dirpath,d)
-            logger.info(f"Processing directory {day_dir}")
-            try:
-                df = process_day_directory(day_dir, args["nproc"], args["test"], logfile)
-            except Exception as e:
-                logger.exception(e)
-            else:
-                dfs.append(df)
-            if args["test"]:
-                break
-        res = pd.concat(dfs, axis=0)
-        res.to_csv(os.path.join(results_dir, "testing" if args["test"] else "processed", f"{k}.csv"), float_format="%g")
-        if args["test"]:
-            break
 
+    outdir = os.path.join(results_dir, "testing" if args["test"] else "processed")
+    ledger = Ledger(os.path.join(outdir, "ledger.sqlite"))
+    quarantine = Quarantine(os.path.join(outdir, "quarantine.json"))
+    fingerprint = code_fingerprint()
+
+    if args["follow"]:
+        args["resume"] = True # so that a restarted follower only picks up what it missed
+
+    start, end = parse_time(args.get("start")), parse_time(args.get("end"))
+    whole = not args["test"] and start is None and end is None
+    files = list_campaign_files(dirs, args["data"], args["test"], max(1,args["nproc"]-1), start, end)
+    if args["follow"]: # files still being written are left to the follower
+        files = {k : [f for f in paths if settled(f)] for k, paths in files.items()}
+    tasks = []
+    skipped = 0
+    for k, paths in files.items():
+        if not args["resume"]: # a ranged run only recomputes its own files
+            ledger.reset(k, None if whole else paths)
+        pending = [f for f in paths if not ledger.is_done(k, f, fingerprint)]
+        if not args["retry_quarantined"]:
+            held = {f for f in pending if quarantine.holds(f)}
+            skipped += len(held)
+            pending = [f for f in pending if f not in held]
+        logger.info(f"Campaign {k} ({dirs[k]}): {len(pending)} of {len(paths)} files pending")
+        tasks.extend((k, f) for f in pending)
+
+    log_queue = multiprocessing.Queue()
+    listener = QueueListener(log_queue, *(logger.handlers or logging.getLogger().handlers), respect_handler_level=True)
+    listener.start()
+
+    profile_dir = None
+    if args["profile"]:
+        profile_dir = os.path.join(outdir, "profiles")
+        os.makedirs(profile_dir, exist_ok=True)
+
+    failures = []
+    records = []
+    for i, (k, filepath, rows, stages, error) in enumerate(process_files(tasks, args["nproc"], log_queue, profile_dir), 1):
+        records.extend(stages)
+        if rows is None:
+            quarantine.add(k, filepath, error)
+            failures.append((k, filepath, error))
+        else:
+            quarantine.release(filepath)
+            ledger.record(k, filepath, fingerprint, rows)
+        if i % 48 == 0 or i == len(tasks):
+            logger.info(f"Completed {i} of {len(tasks)} files ({len(failures)} failed)")
+
+    with instrument.recording(trace_allocations=False) as recorder:
+        write_outputs(ledger, files, outdir, args["test"], args["csv"], whole)
+
+    if args["follow"]:
+        catalogs = {k : Catalog(k, os.path.join(args["data"], dirs[k])) for k in files}
+        failures += follow(catalogs, files, ledger, quarantine, fingerprint, args["nproc"], log_queue, args["test"], start)
+        with instrument.recording(trace_allocations=False) as final:
+            write_outputs(ledger, files, outdir, args["test"], args["csv"], whole) # side outputs and CSVs now include the followed files
+        recorder.records.extend(final.records)
+
+    listener.stop()
+
+    for record in recorder.records:
+        record["file"] = "<output>"
+    records.extend(recorder.records)
+
+    records = pd.DataFrame(records, columns=["file", "stage", "wall", "cpu", "peak_alloc_mb"])
+    records.to_csv(os.path.join(outdir, "process_stages.csv"), index=False, float_format="%g")
+    with open(os.path.join(outdir, "process_report.txt"), "w") as f:
+        f.write(instrument.summarize_records(records))
+
+    if profile_dir is not None:
+        dumps = [os.path.join(profile_dir, name) for name in os.listdir(profile_dir)]
+        instrument.merge_profiles(dumps, os.path.join(outdir, "process_profile.prof"))
+        for dump in dumps:
+            os.remove(dump)
+        logger.info(f"Merged {len(dumps)} worker profiles into {os.path.join(outdir, 'process_profile.prof')}")
+
+    if failures or skipped:
+        logger.warning(failure_summary(failures, skipped))
+    ledger.close()
     logger.info("Complete!")
 
 if __name__ == "__main__":
@@ -0,0 +1,106 @@
+# ruff: noqa: F403, F405
+from definitions import *
+from numpy.lib.stride_tricks import sliding_window_view
+from functools import lru_cache
+import pandas as pd
+import numpy as np
+
+# Power spectra of the (streamwise-aligned) components, then the u-w and w-T cospectra
+SPECTRA_COMPONENTS = ["u", "v", "w", "ts"]
+SPECTRA_QUANTITIES = SPECTRA_COMPONENTS + ["u'w'", "w'ts'"]
+
+
+def gap_fill(x: np.ndarray, max_missing: float = SPECTRA_MAX_MISSING) -> tuple[np.ndarray, np.ndarray]:
+    # Linearly interpolate over missing values in each column of a (rows x series) array. Also returns
+    # which columns are usable, i.e. have at most a `max_missing` fraction of values missing.
+    valid = np.isfinite(x)
+    usable = valid.mean(axis = 0) >= 1 - max_missing
+    filled = np.zeros_like(x)
+    rows = np.arange(x.shape[0])
+    for j in np.flatnonzero(usable):
+        mask = valid[:, j]
+        filled[:, j] = x[:, j] if mask.all() else np.interp(rows, rows[mask], x[mask, j])
+    return filled, usable
+
+
+def bin_edges(fs: float = SAMPLING_FREQUENCY) -> np.ndarray:
+    # Fixed log-spaced bins from the lowest resolved frequency of a full segment up to Nyquist
+    return np.geomspace(fs / SPECTRA_SEGMENT, fs / 2, SPECTRA_BINS + 1)
+
+
+def bin_centers(fs: float = SAMPLING_FREQUENCY) -> np.ndarray:
+    edges = bin_edges(fs)
+    return np.sqrt(edges[:-1] * edges[1:]).astype(np.float32)
+
+
+@lru_cache(maxsize = 8)
+def binning_matrix(length: int, fs: float = SAMPLING_FREQUENCY) -> np.ndarray:
+    # (frequencies x bins) averaging matrix for an rfft of `length` samples; empty bins have all-zero columns
+    freqs = np.fft.rfftfreq(length, 1 / fs)
+    which = np.digitize(freqs, bin_edges(fs)) - 1
+    M = np.zeros((len(freqs), SPECTRA_BINS))
+    inside = (which >= 0) & (which < SPECTRA_BINS) & (freqs > 0)
+    M[np.flatnonzero(inside), which[inside]] = 1.
+    counts = M.sum(axis = 0)
+    M[:, counts > 0] /= counts[counts > 0]
+    return M
+
+
+def chunk_spectra(df: pd.DataFrame, booms: list[int], fs: float = SAMPLING_FREQUENCY) -> np.ndarray:
+    # Welch-averaged, log-binned spectra and cospectra for every boom of one chunk, as a fixed-size
+    # (len(BOOMS) x len(SPECTRA_QUANTITIES) x SPECTRA_BINS) float32 array (NaN where unavailable).
+    # All segments of all series go through a single batched rfft.
+    out = np.full((len(BOOMS), len(SPECTRA_QUANTITIES), SPECTRA_BINS), np.nan, dtype = np.float32)
+    booms = [b for b in booms if b in BOOMS]
+    if not booms:
+        return out
+
+    names = [f"{var}_{b}" for b in booms for var in SPECTRA_COMPONENTS]
+    filled, usable = gap_fill(df[names].to_numpy(dtype = np.float64))
+
+    length = min(SPECTRA_SEGMENT, filled.shape[0])
+    segments = sliding_window_view(filled, length, axis = 0)[::max(length // 2, 1)] # (segments x series x length), 50% overlap
+    window = np.hanning(length)
+    tapered = (segments - segments.mean(axis = -1, keepdims = True)) * window
+    X = np.fft.rfft(tapered, axis = -1)
+    X = X.reshape(X.shape[0], len(booms), len(SPECTRA_COMPONENTS), -1)
+
+    scale = 2 / (fs * (window ** 2).sum()) # one-sided spectral density
+    u, w, ts = (SPECTRA_COMPONENTS.index(var) for var in ["u", "w", "ts"])
+    spectra = np.concatenate([
+        (np.abs(X) ** 2).mean(axis = 0),
+        (X[:, :, u] * np.conj(X[:, :, w])).real.mean(axis = 0)[:, None],
+        (X[:, :, w] * np.conj(X[:, :, ts])).real.mean(axis = 0)[:, None],
+    ], axis = 1) * scale # (booms x quantities x frequencies)
+
+    M = binning_matrix(length, fs)
+    binned = spectra @ M
+    binned[..., M.sum(axis = 0) == 0] = np.nan
+
+    usable = usable.reshape(len(booms), len(SPECTRA_COMPONENTS))
+    binned[:, :len(SPECTRA_COMPONENTS)][~usable] = np.nan
+    binned[:, SPECTRA_QUANTITIES.index("u'w'")][~(usable[:, u] & usable[:, w])] = np.nan
+    binned[:, SPECTRA_QUANTITIES.index("w'ts'")][~(usable[:, w] & usable[:, ts])] = np.nan
+
+    out[[BOOMS.index(b) for b in booms]] = binned
+    return out
+
+
+def save(path: os.PathLike, times: list[pd.Timestamp], spectra: list[np.ndarray]) -> None:
+    stacked = np.stack(spectra) if spectra else np.empty((0, len(BOOMS), len(SPECTRA_QUANTITIES), SPECTRA_BINS), dtype = np.float32)
+    order = np.argsort([t.value for t in times])
+    np.savez(
+        path,
+        time = np.array([times[i].value for i in order], dtype = np.int64), # UTC, ns
+        spectra = stacked[order],
+        frequency = bin_centers(),
+        booms = np.array(BOOMS),
+        quantities = np.array(SPECTRA_QUANTITIES),
+    )
+
+
+def load(path: os.PathLike) -> dict:
+    with np.load(path) as f:
+        data = dict(f)
+    data["time"] = pd.to_datetime(data["time"], utc = True).tz_convert(LOCATION.timezone)
+    return data
@@ -0,0 +1,30 @@
+# ruff: noqa: F403, F405
+from definitions import *
+from fluxes import FLUX_VARIABLES, covariances
+import numpy as np
+
+STATIONARITY_FLUXES = [("w", "u"), ("w", "v"), ("w", "vpt"), ("w", "ts")] # fluxes whose test statistic is reported
+FLAG_FLUXES = [("w", "u"), ("w", "vpt")] # a boom is flagged stationary when all of these pass
+
+
+def relative_deviations(n: np.ndarray, s: np.ndarray, p: np.ndarray, shift: np.ndarray) -> np.ndarray:
+    # Foken-Wichura RN_cov for every boom and variable pair, from the block sums of a chunk split into sub-intervals:
+    # |mean of the sub-interval covariances - covariance over the whole chunk| / |covariance over the whole chunk|
+    _, whole = covariances(n.sum(axis = 0), s.sum(axis = 0), p.sum(axis = 0), shift)
+    _, sub = covariances(n, s, p, shift)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        sub_mean = np.nansum(sub, axis = 0) / np.isfinite(sub).sum(axis = 0)
+        return np.abs((sub_mean - whole) / whole) # (booms x variables x variables)
+
+
+def stationarity_stats(moments: tuple, booms: list[int], threshold: float = STATIONARITY_THRESHOLD) -> dict:
+    # {a}'{b}'_{boom}_rncov for each of STATIONARITY_FLUXES and a stationary_{boom} flag. `moments` must come
+    # from fluxes.block_moments with STATIONARITY_SUBINTERVALS blocks.
+    rn = relative_deviations(*moments)
+    idx = {var : i for i, var in enumerate(FLUX_VARIABLES)}
+    result = {}
+    for k, b in enumerate(booms):
+        for a, c in STATIONARITY_FLUXES:
+            result[f"{a}'{c}'_{b}_rncov"] = rn[k, idx[a], idx[c]]
+        result[f"stationary_{b}"] = bool(all(rn[k, idx[a], idx[c]] <= threshold for a, c in FLAG_FLUXES)) # NaN fails
+    return result
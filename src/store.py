@@ -0,0 +1,96 @@
+from definitions import LOCATION
+from config import results_dir
+import pyarrow.parquet as pq
+import pandas as pd
+import os
+
+
+def store_dir(test: bool = False) -> str:
+    return os.path.join(results_dir, "testing" if test else "processed", "store")
+
+
+def month_of(index: pd.DatetimeIndex) -> pd.Index:
+    # Partitions are by local calendar month
+    return pd.Index(index.tz_convert(LOCATION.timezone).strftime("%Y-%m"))
+
+
+def month_str(time: pd.Timestamp) -> str:
+    return f"{pd.Timestamp(time).tz_convert(LOCATION.timezone):%Y-%m}"
+
+
+def partition_path(root: os.PathLike, campaign: str, month: str) -> str:
+    return os.path.join(root, campaign, f"{month}.parquet")
+
+
+def write_partition(part: pd.DataFrame, path: os.PathLike) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    part.sort_index().reset_index(names = "time").to_parquet(tmp, index = False)
+    os.replace(tmp, path)
+
+
+def write(df: pd.DataFrame, campaign: str, root: os.PathLike, replace: bool = True) -> None:
+    # Summary table (tz-aware `time` index) as one typed Parquet file per month under root/campaign.
+    # With `replace`, month partitions of the campaign that are not in `df` are removed.
+    os.makedirs(os.path.join(root, campaign), exist_ok = True)
+    if df.empty:
+        return
+    months = month_of(df.index)
+    written = set()
+    for month, part in df.groupby(months):
+        path = partition_path(root, campaign, month)
+        write_partition(part, path)
+        written.add(os.path.basename(path))
+    if replace:
+        for name in os.listdir(os.path.join(root, campaign)):
+            if name.endswith(".parquet") and name not in written:
+                os.remove(os.path.join(root, campaign, name))
+
+
+def append(df: pd.DataFrame, campaign: str, root: os.PathLike) -> None:
+    # Adds rows to the month partitions they fall in; stored rows at the same times are replaced, so appending twice is harmless
+    os.makedirs(os.path.join(root, campaign), exist_ok = True)
+    if df.empty:
+        return
+    for month, part in df.groupby(month_of(df.index)):
+        path = partition_path(root, campaign, month)
+        if os.path.exists(path):
+            stored = pd.read_parquet(path).set_index("time")
+            part = pd.concat([stored[~stored.index.isin(part.index)], part])
+        write_partition(part, path)
+
+
+def partitions(campaign: str, root: os.PathLike, start: pd.Timestamp = None, end: pd.Timestamp = None) -> list[str]:
+    # Month files that can hold data in [start, end)
+    directory = os.path.join(root, campaign)
+    if not os.path.isdir(directory):
+        raise FileNotFoundError(f"No stored results for {campaign} in {root}")
+    paths = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".parquet"):
+            continue
+        month = name.removesuffix(".parquet")
+        if start is not None and month < month_str(start):
+            continue
+        if end is not None and month > month_str(end):
+            continue
+        paths.append(os.path.join(directory, name))
+    return paths
+
+
+def available_columns(campaign: str, root: os.PathLike) -> list[str]:
+    paths = partitions(campaign, root)
+    return [] if not paths else [name for name in pq.read_schema(paths[0]).names if name != "time"]
+
+
+def load(campaign: str, root: os.PathLike, columns: list[str] = None, start: pd.Timestamp = None, end: pd.Timestamp = None) -> pd.DataFrame:
+    # Only the requested columns of the month files overlapping [start, end) are read
+    read_columns = None if columns is None else ["time"] + [c for c in columns if c != "time"]
+    parts = [pd.read_parquet(path, columns = read_columns) for path in partitions(campaign, root, start, end)]
+    if not parts:
+        return pd.DataFrame(columns = columns).rename_axis("time")
+    df = pd.concat(parts, ignore_index = True).set_index("time").sort_index()
+    if start is not None:
+        df = df[df.index >= start]
+    if end is not None:
+        df = df[df.index < end]
+    return df